@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from conn import inference_backend
 from online.major import EduQASystem
 from pydantic import BaseModel
 
@@ -9,6 +10,8 @@ class Query(BaseModel):
     session_id: str
 
 app = FastAPI()
+# 推理线程数是进程级设置 在加载任何模型之前设置一次
+inference_backend.configure_threads()
 Edu = EduQASystem()
 # 添加跨域中间件
 app.add_middleware(
@@ -20,10 +23,10 @@ app.add_middleware(
 )
 
 @app.post("/chat")
-def stream_text(query: Query):
-    # 确保返回的是流式生成器
+async def stream_text(query: Query):
+    # 异步生成器 单个worker可以同时挂住大量流
     return StreamingResponse(
-        Edu.get_answer(query.query, query.session_id),
+        Edu.aget_answer(query.query, query.session_id),
         media_type="text/plain"
     )
 @app.get("/new_session")
@@ -0,0 +1,129 @@
+import os
+import numpy as np
+from scipy import sparse
+from datas import filepaths
+
+# 推理后端: "torch" 原始PyTorch模型 / "onnx" ONNX Runtime fp32 / "onnx-int8" 动态int8量化
+backend = "torch"
+# onnxruntime 线程数 None为默认
+onnx_threads = None
+# torch 进程级推理线程数 None为torch默认; 嵌入与重排序模型共用 由configure_threads在启动时设置一次
+torch_threads = None
+# 导出后的onnx模型目录
+ONNX_DIR = os.path.join(filepaths.MODELS_DIR, 'onnx')
+RERANKER_DIR = os.path.join(filepaths.MODELS_DIR, 'bge-reranker-base')
+BGE_M3_DIR = os.path.join(filepaths.MODELS_DIR, 'bge-m3')
+
+
+def onnx_model_path(name, quantized=False):
+    return os.path.join(ONNX_DIR, name, 'model.int8.onnx' if quantized else 'model.onnx')
+
+
+# 进程启动时调用一次 不要在各个模型的构造函数里设置
+def configure_threads(num_threads=None):
+    num_threads = num_threads or torch_threads
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+def _session(model_path, num_threads=onnx_threads):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+
+class OnnxCrossEncoder:
+    """与sentence_transformers.CrossEncoder.predict 输出一致(单标签, sigmoid)的ONNX版本"""
+
+    def __init__(self, model_path, tokenizer_dir, max_length=512, num_threads=onnx_threads):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self.session = _session(model_path, num_threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+
+    def predict(self, pairs, batch_size=32):
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            batch = pairs[i:i + batch_size]
+            inputs = self.tokenizer([p[0] for p in batch], [p[1] for p in batch], padding=True,
+                                    truncation=True, max_length=self.max_length, return_tensors="np")
+            feeds = {k: v.astype(np.int64) for k, v in inputs.items() if k in self.input_names}
+            logits = self.session.run(None, feeds)[0].reshape(-1)
+            scores.append(1 / (1 + np.exp(-logits)))
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+class OnnxBGEM3Embedding:
+    """
+    BGE-M3 稠密+稀疏向量的ONNX版本 输出结构与 milvus_model 的 BGEM3EmbeddingFunction 相同:
+    {"dense": [np.ndarray, ...], "sparse": csr_array(n, vocab_size)}
+    onnx图输出 归一化后的CLS向量 与 每个token的relu(sparse_linear)权重, 稀疏向量的按词取最大值在numpy里做
+    """
+
+    def __init__(self, model_path, tokenizer_dir, max_length=8192, batch_size=16, num_threads=onnx_threads):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        self.session = _session(model_path, num_threads)
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.dim = {"dense": self.session.get_outputs()[0].shape[-1], "sparse": len(self.tokenizer)}
+        self.unused_tokens = np.array([self.tokenizer.cls_token_id, self.tokenizer.eos_token_id,
+                                       self.tokenizer.pad_token_id, self.tokenizer.unk_token_id])
+
+    def __call__(self, texts):
+        dense, rows = [], []
+        for i in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(list(texts[i:i + self.batch_size]), padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            input_ids = inputs["input_ids"].astype(np.int64)
+            dense_out, token_weights = self.session.run(
+                None, {"input_ids": input_ids, "attention_mask": inputs["attention_mask"].astype(np.int64)})
+            dense.extend(dense_out.astype(np.float32))
+            for ids, weights in zip(input_ids, token_weights.reshape(input_ids.shape)):
+                keep = (weights > 0) & ~np.isin(ids, self.unused_tokens)
+                rows.append(self._max_by_token(ids[keep], weights[keep]))
+        return {"dense": dense, "sparse": self._stack(rows)}
+
+    # 同一个token出现多次取最大权重
+    @staticmethod
+    def _max_by_token(ids, weights):
+        if not len(ids):
+            return ids.astype(np.int32), weights.astype(np.float32)
+        order = np.lexsort((-weights, ids))
+        ids, weights = ids[order], weights[order]
+        first = np.concatenate([[True], ids[1:] != ids[:-1]])
+        return ids[first].astype(np.int32), weights[first].astype(np.float32)
+
+    def _stack(self, rows):
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r[0]) for r in rows], out=indptr[1:])
+        indices = np.concatenate([r[0] for r in rows]) if rows else np.zeros(0, dtype=np.int32)
+        data = np.concatenate([r[1] for r in rows]) if rows else np.zeros(0, dtype=np.float32)
+        return sparse.csr_array((data, indices, indptr), shape=(len(rows), self.dim["sparse"]))
+
+    def encode_queries(self, queries):
+        return self(queries)
+
+    def encode_documents(self, documents):
+        return self(documents)
+
+
+def get_embedding_function(name=None):
+    name = name or backend
+    if name == "torch":
+        from milvus_model.hybrid import BGEM3EmbeddingFunction
+        return BGEM3EmbeddingFunction()
+    return OnnxBGEM3Embedding(onnx_model_path('bge-m3', name == "onnx-int8"), BGE_M3_DIR)
+
+
+def get_cross_encoder(device, max_length, name=None):
+    name = name or backend
+    if name == "torch":
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(RERANKER_DIR, device=device, max_length=max_length)
+    return OnnxCrossEncoder(onnx_model_path('bge-reranker-base', name == "onnx-int8"), RERANKER_DIR, max_length)
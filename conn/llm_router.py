@@ -0,0 +1,309 @@
+from conn import llms
+from langchain_core.runnables import Runnable
+from utils.general_utils.loggers import logger
+from collections import deque
+import numpy as np
+import threading
+import asyncio
+import time
+
+# 参与路由的提供方 按优先级排列 没有统计数据时按这个顺序
+router_providers = ["deepseek", "silicon"]
+# 对冲: 首选提供方超过这么久(秒)还没出第一个token 就同时请求第二个 先出token的胜出 另一个取消
+hedge_enabled = False
+hedge_delay = 1.5
+# 统计窗口(最近多少次请求)
+stats_window = 50
+# 窗口内错误率超过该值(且样本数足够) 或连续失败这么多次 就熔断
+max_error_rate = 0.5
+min_samples = 5
+max_consecutive_failures = 3
+# 熔断后的冷却期（秒） 冷却结束后放行一次试探请求, 成功则恢复并清空统计窗口, 失败则再冷却
+failure_cooldown = 30
+
+
+class ProviderStats:
+    """单个提供方最近若干次请求的首token延迟与成败 以及熔断状态"""
+
+    def __init__(self, window=stats_window):
+        self.ttft = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.tripped = False
+        self.cooldown_until = 0.0
+        # 试探请求发出的时间 试探一直没有结果(如被对冲取消)时 过一个冷却期后允许再试探
+        self.probe_at = None
+
+    def record_success(self, ttft):
+        self.ttft.append(ttft)
+        self.outcomes.append(1)
+        self.consecutive_failures = 0
+        if self.tripped:
+            # 试探成功 旧的失败不再计入
+            self.tripped = False
+            self.probe_at = None
+            self.outcomes.clear()
+            self.outcomes.append(1)
+
+    # 对冲中输掉的首选提供方: 已等待的时长(不小于对冲延迟)是它首token延迟的下界 计入 避免它一直因没有样本被优先探测
+    # 输掉的对冲请求只等了很短时间 这个下界没有意义 不能调用这里
+    def record_cancelled(self, waited):
+        self.ttft.append(waited)
+
+    def record_failure(self):
+        self.outcomes.append(0)
+        self.consecutive_failures += 1
+        if self.tripped or self.consecutive_failures >= max_consecutive_failures or \
+                (len(self.outcomes) >= min_samples and self.error_rate() > max_error_rate):
+            self.tripped = True
+            self.probe_at = None
+            self.cooldown_until = time.time() + failure_cooldown
+
+    def error_rate(self):
+        return 1 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def healthy(self):
+        return not self.tripped
+
+    # 只读判断 排序时用 不占用试探名额
+    def available(self, now=None):
+        if not self.tripped:
+            return True
+        now = now or time.time()
+        if now < self.cooldown_until:
+            return False
+        return self.probe_at is None or now - self.probe_at >= failure_cooldown
+
+    def acquire(self, now=None):
+        """
+        真正要向这个提供方发请求时调用 熔断中且冷却结束时只放行一个试探请求
+        :return: 是否为正常放行/试探请求 False表示熔断中 只是其它提供方都失败后的兜底
+        """
+        now = now or time.time()
+        if not self.available(now):
+            return False
+        if self.tripped:
+            self.probe_at = now
+        return True
+
+    # 没有样本时返回None
+    def ttft_p50(self):
+        return float(np.median(self.ttft)) if self.ttft else None
+
+    def summary(self):
+        return {"ttft_p50": self.ttft_p50(),
+                "ttft_p99": float(np.percentile(self.ttft, 99)) if self.ttft else None,
+                "error_rate": self.error_rate(), "samples": len(self.outcomes), "healthy": self.healthy()}
+
+
+class LLMRouter(Runnable):
+    """
+    多提供方LLM路由 可直接替换chain里的llm: prompt | LLMRouter() | parser
+    每次请求按最近的首token延迟(中位数)选最快的健康提供方, 首token之前出错自动换下一个;
+    异步流式时可开启对冲, 首选迟迟不出token就并发请求次选, 取先出token的一方并取消另一方
+    """
+
+    def __init__(self, providers=None, hedge=None, delay=None):
+        """
+        :param providers: 提供方名称列表 见 conn.llms.PROVIDERS
+        :param hedge: 是否对冲 默认取 hedge_enabled
+        :param delay: 对冲等待时间(秒) 默认取 hedge_delay
+        """
+        self.providers = list(providers or router_providers)
+        self.hedge = hedge_enabled if hedge is None else hedge
+        self.delay = hedge_delay if delay is None else delay
+        self.stats = {name: ProviderStats() for name in self.providers}
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # 可用的在前(含冷却结束后的试探) 同为可用/不可用时按首token延迟 没有样本的按配置顺序排在有样本的之后
+    # 只排序不占用试探名额 真正发请求前再调用 _acquire
+    def rank(self):
+        with self._lock:
+            now = time.time()
+            available = {name: self.stats[name].available(now) for name in self.providers}
+
+            def key(item):
+                i, name = item
+                p50 = self.stats[name].ttft_p50()
+                return (not available[name], p50 is None, p50 or 0.0, i)
+            return [name for _, name in sorted(enumerate(self.providers), key=key)]
+
+    def _acquire(self, name):
+        with self._lock:
+            return self.stats[name].acquire()
+
+    def _success(self, name, ttft):
+        with self._lock:
+            self.stats[name].record_success(ttft)
+
+    def _failure(self, name, error):
+        with self._lock:
+            self.stats[name].record_failure()
+        logger.warning(f"LLM提供方{name}请求失败:{error}")
+
+    # ------------------ 同步 ------------------
+    def invoke(self, input, config=None, **kwargs):
+        error = None
+        for name in self.rank():
+            self._acquire(name)
+            start = time.perf_counter()
+            try:
+                output = llms.get_llm(name).invoke(input, config, **kwargs)
+            except Exception as e:
+                self._failure(name, e)
+                error = e
+                continue
+            # 非流式时只能记录整体延迟
+            self._success(name, time.perf_counter() - start)
+            return output
+        raise error
+
+    def stream(self, input, config=None, **kwargs):
+        error = None
+        for name in self.rank():
+            self._acquire(name)
+            start = time.perf_counter()
+            try:
+                iterator = iter(llms.get_llm(name).stream(input, config, **kwargs))
+                first = next(iterator)
+            except StopIteration:
+                self._success(name, time.perf_counter() - start)
+                return
+            except Exception as e:
+                self._failure(name, e)
+                error = e
+                continue
+            self._success(name, time.perf_counter() - start)
+            yield first
+            # 已经输出了内容 之后出错只能抛出
+            try:
+                yield from iterator
+            except Exception as e:
+                self._failure(name, e)
+                raise
+            return
+        raise error
+
+    # ------------------ 异步 ------------------
+    async def ainvoke(self, input, config=None, **kwargs):
+        error = None
+        for name in self.rank():
+            self._acquire(name)
+            start = time.perf_counter()
+            try:
+                output = await llms.get_llm(name).ainvoke(input, config, **kwargs)
+            except Exception as e:
+                self._failure(name, e)
+                error = e
+                continue
+            self._success(name, time.perf_counter() - start)
+            return output
+        raise error
+
+    @staticmethod
+    async def _next(agen):
+        try:
+            return True, await agen.__anext__()
+        except StopAsyncIteration:
+            return False, None
+
+    @staticmethod
+    async def _cancel(task, agen):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            await agen.aclose()
+        except Exception:
+            pass
+
+    async def _race(self, input, config, kwargs):
+        """
+        依次/对冲地发起请求 直到某个提供方产出第一个chunk
+        :return: (提供方, 异步迭代器, 是否有第一个chunk, 第一个chunk)
+        """
+        candidates = self.rank()
+        primary = candidates[0]
+        pending = {}
+        error = None
+        hedged = False
+
+        def launch():
+            name = candidates.pop(0)
+            self._acquire(name)
+            agen = llms.get_llm(name).astream(input, config, **kwargs).__aiter__()
+            pending[asyncio.ensure_future(self._next(agen))] = (name, agen, time.perf_counter())
+
+        launch()
+        while pending:
+            can_hedge = self.hedge and not hedged and candidates and len(pending) == 1
+            done, _ = await asyncio.wait(pending, timeout=self.delay if can_hedge else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                self.hedges += 1
+                logger.info(f"LLM对冲: {next(iter(pending.values()))[0]} {self.delay}s未出token, 同时请求{candidates[0]}")
+                launch()
+                continue
+            for task in done:
+                name, agen, start = pending.pop(task)
+                try:
+                    has_first, first = task.result()
+                except Exception as e:
+                    self._failure(name, e)
+                    error = e
+                    # 首token前失败 换下一个提供方
+                    if not pending and candidates:
+                        launch()
+                    continue
+                self._success(name, time.perf_counter() - start)
+                if hedged and name != primary:
+                    self.hedge_wins += 1
+                for loser_task, (loser, loser_agen, loser_start) in list(pending.items()):
+                    if loser == primary:
+                        with self._lock:
+                            self.stats[loser].record_cancelled(time.perf_counter() - loser_start)
+                    await self._cancel(loser_task, loser_agen)
+                return name, agen, has_first, first
+        raise error
+
+    async def astream(self, input, config=None, **kwargs):
+        name, agen, has_first, first = await self._race(input, config, kwargs)
+        try:
+            if not has_first:
+                return
+            yield first
+            try:
+                async for chunk in agen:
+                    yield chunk
+            except Exception as e:
+                self._failure(name, e)
+                raise
+        finally:
+            # 调用方提前断开(客户端断连)时也关闭上游流 释放HTTP连接
+            await agen.aclose()
+
+    def summary(self):
+        with self._lock:
+            return {"providers": {name: stats.summary() for name, stats in self.stats.items()},
+                    "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+
+
+if __name__ == '__main__':
+    # 对着本地stub测试: 先启动两个 offline/llm_stub/stub_server.py
+    #   python -m offline.llm_stub.stub_server --port 9001 --ttft 2.0
+    #   python -m offline.llm_stub.stub_server --port 9002 --ttft 0.2 --error-rate 0.1
+    llms.PROVIDERS["stub_slow"] = {"model": "stub", "base_url": "http://127.0.0.1:9001/v1", "api_key": "stub"}
+    llms.PROVIDERS["stub_fast"] = {"model": "stub", "base_url": "http://127.0.0.1:9002/v1", "api_key": "stub"}
+    router = LLMRouter(["stub_slow", "stub_fast"], hedge=True, delay=0.5)
+
+    async def main():
+        for _ in range(20):
+            try:
+                async for _ in router.astream("hello"):
+                    pass
+            except Exception as e:
+                logger.info(f"请求失败:{e}")
+        logger.info(router.summary())
+    asyncio.run(main())
@@ -1,31 +1,115 @@
 from langchain_openai import ChatOpenAI
 from langchain_ollama import OllamaEmbeddings,OllamaLLM
-def get_deepseek():
-    from env import deepseek_envs
-    llm = ChatOpenAI(
-            model="deepseek-chat",
-            base_url="https://api.deepseek.com/v1"
+from utils.general_utils.loggers import logger
+import importlib.util
+import threading
+import httpx
+
+# 所有OpenAI兼容客户端共用的连接池：最大连接数、保活连接数、保活时长（秒）
+llm_max_connections = 100
+llm_max_keepalive = 20
+llm_keepalive_expiry = 120
+# 超时（秒）：建连 / 读(流式时为两个chunk之间的最长间隔) / 整体
+llm_connect_timeout = 5
+llm_read_timeout = 60
+llm_timeout = 120
+# openai客户端内置的指数退避重试次数(连接错误、429、5xx)
+llm_max_retries = 2
+# 需要安装h2 没装时退回http/1.1
+llm_http2 = importlib.util.find_spec("h2") is not None
+
+# 各提供方的模型与地址
+PROVIDERS = {
+    "deepseek": {"model": "deepseek-chat", "base_url": "https://api.deepseek.com/v1"},
+    "silicon": {"model": "Qwen/Qwen3-Next-80B-A3B-Instruct", "base_url": "https://api.siliconflow.cn/v1"},
+    "ollama": {"model": "llama3.2:1b", "base_url": "http://localhost:11434"},
+}
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def _timeout():
+    return httpx.Timeout(llm_timeout, connect=llm_connect_timeout, read=llm_read_timeout)
+
+
+def _limits():
+    return httpx.Limits(max_connections=llm_max_connections, max_keepalive_connections=llm_max_keepalive,
+                        keepalive_expiry=llm_keepalive_expiry)
+
+
+def _get(name, build):
+    # 每个客户端只建一次 同步/异步链共用 连接(含TLS会话)在请求之间复用
+    if name not in _registry:
+        with _lock:
+            if name not in _registry:
+                _registry[name] = build()
+    return _registry[name]
+
+
+def http_client():
+    return _get("http_client", lambda: httpx.Client(http2=llm_http2, limits=_limits(), timeout=_timeout()))
+
+
+def http_async_client():
+    return _get("http_async_client",
+                lambda: httpx.AsyncClient(http2=llm_http2, limits=_limits(), timeout=_timeout()))
+
+
+def _chat_openai(provider, **kwargs):
+    logger.info(f"创建LLM客户端:{provider} http2={llm_http2}")
+    if PROVIDERS[provider].get("api_key"):
+        kwargs.setdefault("api_key", PROVIDERS[provider]["api_key"])
+    return ChatOpenAI(
+            model=PROVIDERS[provider]["model"],
+            base_url=PROVIDERS[provider]["base_url"],
+            http_client=http_client(),
+            http_async_client=http_async_client(),
+            timeout=_timeout(),
+            max_retries=llm_max_retries,
+            **kwargs
         )
-    return llm
+
+
+def get_llm(provider):
+    """
+    :param provider: deepseek / silicon / ollama 或 PROVIDERS 中另外登记的OpenAI兼容服务(如本地stub)
+    :return: 该提供方共享的LLM客户端
+    """
+    if provider == "deepseek":
+        return get_deepseek()
+    if provider == "silicon":
+        return get_silicon()
+    if provider == "ollama":
+        return get_ollama()
+    if provider not in PROVIDERS:
+        raise ValueError(f"未知的LLM提供方:{provider}")
+    return _get(provider, lambda: _chat_openai(provider))
+
+
+def get_deepseek():
+    def build():
+        from env import deepseek_envs
+        return _chat_openai("deepseek")
+    return _get("deepseek", build)
 
 def get_embedding_model():
     embd_llm = OllamaEmbeddings(model="nomic-embed-text:latest", base_url="http://localhost:11434")
     return embd_llm
 
 def get_ollama():
-    llm = OllamaLLM(
-            model="llama3.2:1b",
-            base_url="http://localhost:11434"
-        )
-    return llm
+    # 本地服务没有TLS 只需要共享客户端和超时
+    return _get("ollama", lambda: OllamaLLM(
+            model=PROVIDERS["ollama"]["model"],
+            base_url=PROVIDERS["ollama"]["base_url"],
+            client_kwargs={"timeout": _timeout()}
+        ))
 
 def get_silicon():
-    from env import silicon_envs
-    llm = ChatOpenAI(
-            model="Qwen/Qwen3-Next-80B-A3B-Instruct",
-            base_url='https://api.siliconflow.cn/v1',
-        )
-    return llm
+    def build():
+        from env import silicon_envs
+        return _chat_openai("silicon")
+    return _get("silicon", build)
 
 if __name__ == '__main__':
     # emb = get_embedding_model()
@@ -34,4 +118,4 @@ if __name__ == '__main__':
 
     llm = get_ollama()
     a = llm.invoke("hello world")
-    print(a)
\ No newline at end of file
+    print(a)
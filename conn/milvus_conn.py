@@ -1,4 +1,4 @@
-from pymilvus import MilvusClient
+from pymilvus import MilvusClient, AsyncMilvusClient
 from base import config_gen as cfg
 
 # 前端：http://47.108.85.255:8000/
@@ -40,6 +40,24 @@ class MilvusConn:
 
 
 
+# 异步客户端 grpc的aio通道要在事件循环中创建，所以按需初始化
+class AsyncMilvusConn:
+    def __init__(self,db_name=cfg.MILVUS.DATABASE_NAME):
+        self.db_name = db_name
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = AsyncMilvusClient(uri=f"http://{cfg.MILVUS.HOST}:{cfg.MILVUS.PORT}",
+                                             db_name=self.db_name)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
 
 if __name__ == "__main__":
     miC = MilvusConn()
@@ -1,20 +1,48 @@
 import pymysql
+import asyncio
+import aiomysql
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from base import config_gen as cfg
 from uuid import uuid4
 from pymysql.cursors import DictCursor
 
+# 同步连接池: 最大连接数、取连接的最长等待（秒）、空闲超过多久取出时才ping（秒）
+mysql_pool_size = 10
+mysql_pool_timeout = 10
+mysql_idle_check = 30
+
+
+def _connect(autocommit=False):
+    return pymysql.connect(
+        host=cfg.MYSQL.HOST,
+        port=int(cfg.MYSQL.PORT),
+        user=cfg.MYSQL.USER,
+        password=cfg.MYSQL.PASSWORD,
+        database=cfg.MYSQL.DATABASE,
+        autocommit=autocommit,
+        cursorclass=DictCursor # 设置查询返回字典
+    )
+
+
+# 整理插入语句 缺少id的行随机生成id
+def _prepare_insert(table_name, datas):
+    if not isinstance(datas, list):
+        datas = [datas]
+    for d in datas:
+        d['id']=d.get('id',str(uuid4())) #若无则随机生成id
+    sql = f"INSERT INTO `{table_name}` ({','.join(datas[0].keys())}) VALUES ({','.join(['%s'] * len(datas[0]))})\n"
+    ds = [tuple(d.values()) for d in datas]
+    ids = [d['id'] for d in datas]
+    return sql, ds, ids[0] if len(ids) == 1 else ids
+
 
 class MysqlConn:
 
     def __init__(self):
-        self.conn = pymysql.connect(
-            host=cfg.MYSQL.HOST,
-            port=int(cfg.MYSQL.PORT),
-            user=cfg.MYSQL.USER,
-            password=cfg.MYSQL.PASSWORD,
-            database=cfg.MYSQL.DATABASE,
-            cursorclass=DictCursor # 设置查询返回字典
-        )
+        self.conn = _connect()
 
     # 插入数据
     def insert(self,table_name, datas):
@@ -26,20 +54,11 @@ class MysqlConn:
         self.conn.ping(reconnect=True)
         if not datas:
             return []
-        if not isinstance(datas, list):
-            datas = [datas]
-        for d in datas:
-            d['id']=d.get('id',str(uuid4())) #若无则随机生成id
+        sql, ds, ids = _prepare_insert(table_name, datas)
         with self.conn.cursor() as cursor:
-            sql = f"INSERT INTO `{table_name}` ({','.join(datas[0].keys())}) VALUES ({','.join(['%s'] * len(datas[0]))})\n"
-            ds = [tuple(d.values()) for d in datas]
             cursor.executemany(sql,ds)
         self.conn.commit()
-        ids = [d['id'] for d in datas]
-        if len(ids) == 1:
-            return ids[0]
-        else:
-            return ids
+        return ids
 
 
     # 普通查询
@@ -86,10 +105,244 @@ class MysqlConn:
             cursor.execute(sql)
         self.conn.commit()
 
+    # 批量执行参数化SQL
+    def execute_many(self,sql,params_list):
+        """
+        :param sql: 示例 sql: "UPDATE table SET answer=%s WHERE id=%s"
+        :param params_list: 参数元组列表
+        :return: None
+        """
+        if not params_list:
+            return
+        self.conn.ping(reconnect=True)
+        with self.conn.cursor() as cursor:
+            cursor.executemany(sql,params_list)
+        self.conn.commit()
+
     def close(self):
         self.conn.close()
 
 
+# 线程安全的同步连接池 接口与MysqlConn一致 managers直接替换使用
+# 连接为自动提交模式 每条语句单独生效
+class PooledMysqlConn:
+
+    def __init__(self, size=mysql_pool_size, timeout=mysql_pool_timeout, idle_check=mysql_idle_check):
+        """
+        :param size: 最大连接数 连接按需创建
+        :param timeout: 连接全部借出时的最长等待（秒）
+        :param idle_check: 连接空闲超过该秒数 借出前先ping一次 其余情况不ping
+        """
+        self.size = size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = deque() # (连接, 归还时间) 后进先出 常用的连接保持热
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.created = 0
+        self.pings = 0
+
+    def _checkout(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"mysql连接池已满({self.size}) 等待{self.timeout}秒未取到连接")
+        try:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                # 自动提交: 读语句不会留下打开的事务 归还时不需要额外的ROLLBACK往返
+                conn = _connect(autocommit=True)
+                with self._lock:
+                    self.created += 1
+                return conn
+            conn, released_at = entry
+            if time.time() - released_at >= self.idle_check:
+                conn.ping(reconnect=True)
+                self.pings += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn, broken=False):
+        try:
+            if broken:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.time()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def lease(self):
+        """
+        借出一个连接 同一线程内嵌套的lease与本类方法复用同一个连接,
+        可以在一次请求里 with pool.lease(): 包住多条语句, 只借还一次
+        需要事务时在lease里调用 conn.begin() / conn.commit(), 出错时自动回滚
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        broken = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # 连接已断开 丢弃 下次借出时新建
+            broken = True
+            raise
+        except Exception:
+            # 调用方在lease里显式begin()的事务 出错时回滚
+            try:
+                conn.rollback()
+            except pymysql.err.Error:
+                broken = True
+            raise
+        finally:
+            self._local.conn = None
+            self._checkin(conn, broken)
+
+    # 插入数据
+    def insert(self,table_name, datas):
+        """
+        :param table_name:  表名
+        :param datas: 字典列表的数据 同MysqlConn.insert
+        :return: 插入的ID或ids列表
+        """
+        if not datas:
+            return []
+        sql, ds, ids = _prepare_insert(table_name, datas)
+        with self.lease() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(sql,ds)
+        return ids
+
+    # 普通查询
+    def search_by_sql(self,sql):
+        with self.lease() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                return cursor.fetchall()
+
+    # 参数化查询
+    def search_with_params(self,sql,params):
+        with self.lease() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(sql,params)
+                return cursor.fetchall()
+
+    # 查询所有
+    def searh_all(self,table_name,cols):
+        return self.search_by_sql(f"SELECT {','.join(cols)} FROM {table_name}")
+
+    # 执行SQL
+    # 返回影响的行数
+    def execute(self,sql,params=None):
+        with self.lease() as conn:
+            with conn.cursor() as cursor:
+                rowcount = cursor.execute(sql,params)
+        return rowcount
+
+    # 批量执行参数化SQL
+    def execute_many(self,sql,params_list):
+        if not params_list:
+            return
+        with self.lease() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(sql,params_list)
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+        return {"size": self.size, "created": self.created, "idle": idle, "pings": self.pings}
+
+    # 关闭空闲连接 借出中的连接归还后照常入池
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            conn.close()
+
+
+# 异步连接池 给async的/chat链路用 接口与MysqlConn保持一致
+class AsyncMysqlConn:
+
+    def __init__(self, maxsize=20):
+        self.maxsize = maxsize
+        self.pool = None
+        self._lock = asyncio.Lock()
+
+    # 连接池要在事件循环里创建，第一次用到时再建
+    async def _get_pool(self):
+        if self.pool is None:
+            async with self._lock:
+                if self.pool is None:
+                    self.pool = await aiomysql.create_pool(
+                        host=cfg.MYSQL.HOST,
+                        port=int(cfg.MYSQL.PORT),
+                        user=cfg.MYSQL.USER,
+                        password=cfg.MYSQL.PASSWORD,
+                        db=cfg.MYSQL.DATABASE,
+                        maxsize=self.maxsize,
+                        pool_recycle=3600, # 代替每次ping 超过1小时的空闲连接直接重建
+                        autocommit=True, # 读语句不会留下旧快照 写语句的commit照常无害
+                        cursorclass=aiomysql.DictCursor
+                    )
+        return self.pool
+
+    # 插入数据
+    async def insert(self, table_name, datas):
+        """
+        :param table_name:  表名
+        :param datas: 字典列表的数据 同MysqlConn.insert
+        :return: 插入的ID或ids列表
+        """
+        if not datas:
+            return []
+        sql, ds, ids = _prepare_insert(table_name, datas)
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(sql, ds)
+            await conn.commit()
+        return ids
+
+    # 参数化查询
+    async def search_with_params(self, sql, params):
+        """
+        :param sql: 示例 sql: "SELECT * FROM table WHERE question=%s"
+        :param params: 参数元组 示例 params = ('问题1',)
+        :return: 查询结果  list
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, params)
+                return await cursor.fetchall()
+
+    # 执行SQL
+    async def execute(self, sql, params=None):
+        """
+        :param sql: 示例 sql: "DELETE FROM table WHERE question=%s"
+        :param params: 参数元组 可选
+        :return: None
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, params)
+            await conn.commit()
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+
 
 if __name__ == '__main__':
     mc = MysqlConn()
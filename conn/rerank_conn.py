@@ -1,21 +1,88 @@
-from sentence_transformers import CrossEncoder
 import torch
-from datas import filepaths
-import os
+import numpy as np
+from conn import inference_backend
+from utils.general_utils.globle_util import gen_hash
+from utils.general_utils.lru_cache import LRUCache
 device = "cuda" if torch.cuda.is_available() else "cpu"
 
+# 重排序参数：模型最大输入长度(token)、批大小  推理线程数见 inference_backend.torch_threads
+rerank_max_length = 512
+rerank_batch_size = 16
+# 长文档按窗口切分后取最高分, 1 表示只看开头一个窗口(截断)
+rerank_max_windows = 1
+# (query, 文档) 得分缓存条数
+rerank_cache_size = 20000
+
 
 class RerankModel():
-    def __init__(self, device=device):
-        model_path = os.path.join(filepaths.MODELS_DIR, 'bge-reranker-base') # rerank模型地址
-        self.model = CrossEncoder(model_path, device=device)
-
-    def rerank(self, query, docs):
-        pairs = [[query, doc] for doc in docs]
-        # 使用 BGE-Reranker 计算每个配对的得分
-        scores = self.model.predict(pairs)
+    def __init__(self, device=device, max_length=rerank_max_length, batch_size=rerank_batch_size,
+                 max_windows=rerank_max_windows, backend=None):
+        # 按配置的推理后端加载 torch的CrossEncoder或onnxruntime版本 两者predict接口一致
+        self.model = inference_backend.get_cross_encoder(device, max_length, backend)
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_windows = max_windows
+        self.score_cache = LRUCache(rerank_cache_size)
+
+    # 长文档切成若干窗口 超长部分不再送进模型
+    def _windows(self, query, doc):
+        if self.max_windows <= 1:
+            # 模型内部会按max_length截断 这里先按字符粗截一下 避免对超长文本做无用的分词
+            return [doc[:self.max_length * 4]]
+        budget = max(self.max_length - len(self.model.tokenizer.tokenize(query)) - 4, 32)
+        offsets = self.model.tokenizer(doc, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        windows = []
+        for start in range(0, max(len(offsets), 1), budget):
+            if len(windows) >= self.max_windows or start >= len(offsets):
+                break
+            end = min(start + budget, len(offsets)) - 1
+            windows.append(doc[offsets[start][0]:offsets[end][1]])
+        return windows or [doc]
+
+    def score(self, query, docs, doc_ids=None):
+        """
+        :param query: 查询
+        :param docs: 文档列表
+        :param doc_ids: 文档id列表 用于得分缓存 默认用文档内容的hash
+        :return: 与docs对齐的得分数组
+        """
+        query_hash = gen_hash(query)
+        doc_ids = doc_ids or [gen_hash(doc) for doc in docs]
+        scores = np.zeros(len(docs), dtype=np.float32)
+        pairs, owners = [], []
+        for i, (doc, doc_id) in enumerate(zip(docs, doc_ids)):
+            cached = self.score_cache.get((query_hash, doc_id))
+            if cached is not None:
+                scores[i] = cached
+                continue
+            for window in self._windows(query, doc):
+                pairs.append([query, window])
+                owners.append(i)
+        if pairs:
+            # 按长度排序后再分批 同一批长度相近 padding更少
+            order = np.argsort([len(p[1]) for p in pairs], kind="stable")
+            sorted_scores = self.model.predict([pairs[j] for j in order], batch_size=self.batch_size)
+            pair_scores = np.empty(len(pairs), dtype=np.float32)
+            pair_scores[order] = sorted_scores
+            # 多窗口取最高分
+            owners = np.asarray(owners)
+            computed = np.full(len(docs), -np.inf, dtype=np.float32)
+            np.maximum.at(computed, owners, pair_scores)
+            for i in np.unique(owners):
+                scores[i] = computed[i]
+                self.score_cache.set((query_hash, doc_ids[i]), float(computed[i]))
+        return scores
+
+    # 返回按得分降序的下标和得分
+    def rank(self, query, docs, doc_ids=None):
+        scores = self.score(query, docs, doc_ids)
+        order = np.argsort(-scores, kind="stable")
+        return order, scores[order]
+
+    def rerank(self, query, docs, doc_ids=None):
+        order, _ = self.rank(query, docs, doc_ids)
         # 根据得分从高到低排序文档
-        ranked_docs = [doc for score, doc in sorted(zip(scores, docs), reverse=True)]
+        ranked_docs = [docs[i] for i in order]
         return ranked_docs
 
 
@@ -25,4 +92,3 @@ if __name__ == '__main__':
     passages = ["样例文档-1", "样例文档-2"]
     docs = model.rerank(queries, passages)
     print(docs)
-
@@ -0,0 +1,101 @@
+from conn import rerank_conn, inference_backend
+from base import configs
+from managers.mysql_manager import ParentManager
+from utils.general_utils.loggers import logger
+import numpy as np
+import threading
+import asyncio
+import os
+
+# 第一级: WeightedRanker得分 top1达到置信度且领先top2足够多时直接返回, 不做重排序
+hybrid_confidence = 1.2
+hybrid_margin = 0.15
+# 第二级: 轻量重排序(int8量化+短输入) 的置信度与领先幅度, 后端为None时跳过这一级
+# onnx模型文件还没导出时跳过这一级: 再加载一份torch版同一模型只会让模糊查询多跑一遍cross-encoder
+mid_backend = "onnx-int8"
+mid_max_length = 256
+mid_confidence = 0.8
+mid_margin = 0.3
+
+
+class CascadeRetriever:
+    """
+    级联检索: 混合检索结果已经足够明确时提前返回, 只对模糊的查询逐级使用更贵的重排序
+      hybrid -> 轻量重排序 -> 完整cross-encoder
+    每一级的命中次数都有统计, 用于调整阈值
+    """
+    stages = ("hybrid", "mid", "full")
+
+    def __init__(self, vector_store):
+        """
+        :param vector_store: managers.vector_store.VectorStore 实例
+        """
+        self.vector_store = vector_store
+        self.mid_backend = self._resolve_mid_backend()
+        self._mid_model = None
+        self._lock = threading.Lock()
+        self.counts = {stage: 0 for stage in self.stages}
+
+    @property
+    def mid_model(self):
+        if self.mid_backend and self._mid_model is None:
+            with self._lock:
+                if self._mid_model is None:
+                    self._mid_model = rerank_conn.RerankModel(max_length=mid_max_length, backend=self.mid_backend)
+        return self._mid_model
+
+    @staticmethod
+    def _resolve_mid_backend():
+        if not mid_backend or not mid_backend.startswith("onnx"):
+            return mid_backend
+        model_path = inference_backend.onnx_model_path('bge-reranker-base', mid_backend == "onnx-int8")
+        if os.path.exists(model_path):
+            return mid_backend
+        logger.warning(f"未找到{model_path}, 跳过轻量重排序这一级")
+        return None
+
+    # top1得分够高且与top2拉开差距才算明确
+    @staticmethod
+    def _decisive(scores, confidence, margin):
+        if len(scores) == 0:
+            return True
+        top = np.sort(np.asarray(scores, dtype=np.float32))[::-1]
+        second = top[1] if len(top) > 1 else -np.inf
+        return top[0] >= confidence and top[0] - second >= margin
+
+    def _record(self, query, stage):
+        with self._lock:
+            self.counts[stage] += 1
+        logger.info(f"级联检索:{query} 在{stage}阶段结束")
+
+    # 已经取回父文档后的级联判断 纯CPU计算
+    def _cascade(self, query, hits, parents, m):
+        hits = [(parent_id, score) for parent_id, score in hits if parent_id in parents]
+        ids = [parent_id for parent_id, _ in hits]
+        docs = [parents[parent_id] for parent_id in ids]
+        if self._decisive([score for _, score in hits], hybrid_confidence, hybrid_margin):
+            self._record(query, "hybrid")
+            return docs[:m]
+        if self.mid_model is not None:
+            order, scores = self.mid_model.rank(query, docs, ids)
+            if self._decisive(scores, mid_confidence, mid_margin):
+                self._record(query, "mid")
+                return [docs[i] for i in order[:m]]
+        self._record(query, "full")
+        return self.vector_store.rerank(query, docs, m, ids)
+
+    def search(self, query, k=configs.RETRIEVAL_K, m=configs.CANDIDATE_M, subjects=None):
+        hits = self.vector_store.hybrid_search_hits(query, k, subjects)
+        parents = ParentManager.get_parent_map([parent_id for parent_id, _ in hits])
+        return self._cascade(query, hits, parents, m)
+
+    async def asearch(self, query, k=configs.RETRIEVAL_K, m=configs.CANDIDATE_M, subjects=None):
+        hits = await self.vector_store.ahybrid_search_hits(query, k, subjects)
+        parents = await ParentManager.aget_parent_map([parent_id for parent_id, _ in hits])
+        return await asyncio.to_thread(self._cascade, query, hits, parents, m)
+
+    # 各阶段的结束比例
+    def stats(self):
+        total = sum(self.counts.values())
+        return {stage: {"count": count, "rate": count / total if total else 0.0}
+                for stage, count in self.counts.items()}
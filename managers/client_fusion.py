@@ -0,0 +1,141 @@
+from base import configs
+from managers.mysql_manager import ParentManager, QuestionManager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import asyncio
+import jieba
+
+# 融合方式: "rrf" 倒数排名融合 / "weighted" 原始分加权 / "normalized" 每路min-max归一化后加权
+fusion_method = "rrf"
+rrf_k = 60
+# 是否把FAQ的BM25命中也作为一路召回
+fusion_with_bm25 = False
+bm25_weight = 0.5
+bm25_top_k = 5
+# FAQ文档在融合结果中的id前缀
+FAQ_PREFIX = "faq:"
+
+
+def fuse(ranked_lists, weights, method=fusion_method, k=10):
+    """
+    客户端融合多路召回结果 向量化计算
+    :param ranked_lists: 每一路的 [(id, score)] 已按得分降序
+    :param weights: 每一路的权重
+    :param method: rrf / weighted / normalized
+    :param k: 返回数量
+    :return: 融合后按得分降序的 [(id, score)]
+    """
+    lists = [lst for lst in ranked_lists if lst]
+    weights = [w for lst, w in zip(ranked_lists, weights) if lst]
+    if not lists:
+        return []
+    ids = np.concatenate([np.asarray([i for i, _ in lst], dtype=object) for lst in lists])
+    scores = np.concatenate([np.asarray([s for _, s in lst], dtype=np.float64) for lst in lists])
+    ranks = np.concatenate([np.arange(len(lst)) for lst in lists])
+    route = np.repeat(np.arange(len(lists)), [len(lst) for lst in lists])
+    w = np.asarray(weights, dtype=np.float64)[route]
+    if method == "rrf":
+        contrib = w / (rrf_k + ranks + 1)
+    elif method == "normalized":
+        lo = np.minimum.reduceat(scores, np.r_[0, np.cumsum([len(lst) for lst in lists])[:-1]])[route]
+        hi = np.maximum.reduceat(scores, np.r_[0, np.cumsum([len(lst) for lst in lists])[:-1]])[route]
+        contrib = w * np.where(hi > lo, (scores - lo) / np.where(hi > lo, hi - lo, 1), 1.0)
+    else:
+        contrib = w * scores
+    unique_ids, inverse = np.unique(ids.astype(str), return_inverse=True)
+    fused = np.bincount(inverse, weights=contrib, minlength=len(unique_ids))
+    order = np.argsort(-fused, kind="stable")[:k]
+    return [(str(unique_ids[i]), float(fused[i])) for i in order]
+
+
+class FusionRetriever:
+    """
+    稠密与稀疏两路检索并发执行, 在客户端融合(可选再加上FAQ的BM25召回)
+    作为服务端 hybrid_search + WeightedRanker 的替代方案
+    """
+
+    def __init__(self, vector_store, bm25=None):
+        """
+        :param vector_store: managers.vector_store.VectorStore 实例
+        :param bm25: online.mysql_search.bm25_search.BM25Search 实例 可选
+        """
+        self.vector_store = vector_store
+        self.bm25 = bm25
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fusion")
+
+    def _search_params(self, query_embeddings, c, subjects=None):
+        dense_request, sparse_request = self.vector_store._build_search_requests(query_embeddings, c)
+        expr = self.vector_store.subject_filter(subjects)
+        return [
+            dict(data=dense_request.data, anns_field="dense_vector", search_params=dense_request.param, limit=c,
+                 filter=expr),
+            dict(data=sparse_request.data, anns_field="sparse_vector", search_params=sparse_request.param, limit=c,
+                 filter=expr),
+        ]
+
+    # FAQ召回 BM25在内存中 直接计算
+    def _bm25_hits(self, query):
+        if not (fusion_with_bm25 and self.bm25 is not None):
+            return []
+        hits = self.bm25.bm25.top_k(jieba.lcut(query.lower()), bm25_top_k)
+        return [(FAQ_PREFIX + str(i), score) for i, score in hits if score > 0]
+
+    def _fuse(self, dense_hits, sparse_hits, bm25_hits, k):
+        dense = self.vector_store._extract_parent_hits(dense_hits)
+        sparse = self.vector_store._extract_parent_hits(sparse_hits)
+        return fuse([dense, sparse, bm25_hits], [configs.DENSE_WEIGHT, configs.SPARSE_WEIGHT, bm25_weight],
+                    fusion_method, k)
+
+    # 融合结果转成文档内容 父文档与FAQ分别批量查询
+    @staticmethod
+    def _to_docs(fused, parents, faqs):
+        # 问题主键是int 融合时统一成了str
+        faqs = {str(key): value for key, value in faqs.items()}
+        docs = []
+        for doc_id, _ in fused:
+            if doc_id.startswith(FAQ_PREFIX):
+                faq = faqs.get(doc_id[len(FAQ_PREFIX):])
+                if faq:
+                    docs.append(f"问题:{faq['question']}\n答案:{faq['answer']}")
+            elif doc_id in parents:
+                docs.append(parents[doc_id])
+        return docs
+
+    @staticmethod
+    def _split_ids(fused):
+        parent_ids = [i for i, _ in fused if not i.startswith(FAQ_PREFIX)]
+        faq_ids = [i[len(FAQ_PREFIX):] for i, _ in fused if i.startswith(FAQ_PREFIX)]
+        return parent_ids, faq_ids
+
+    def search_hits(self, query, c=configs.c, k=configs.k, subjects=None):
+        query_embeddings = self.vector_store.embed_query(query)
+        client = self.vector_store.client
+        futures = [self.executor.submit(client.search, collection_name=self.vector_store.collection_name,
+                                        output_fields=["parent_id"], **params)
+                   for params in self._search_params(query_embeddings, c, subjects)]
+        bm25_hits = self._bm25_hits(query)
+        dense, sparse = [f.result()[0] for f in futures]
+        return self._fuse(dense, sparse, bm25_hits, k)
+
+    def search(self, query, c=configs.c, k=configs.k, subjects=None):
+        fused = self.search_hits(query, c, k, subjects)
+        parent_ids, faq_ids = self._split_ids(fused)
+        parents = ParentManager.get_parent_map(parent_ids)
+        faqs = QuestionManager.get_faqs_by_ids(faq_ids)
+        return self._to_docs(fused, parents, faqs)
+
+    async def asearch_hits(self, query, c=configs.c, k=configs.k, subjects=None):
+        query_embeddings = await self.vector_store.aembed_query(query)
+        client = self.vector_store.async_conn.client
+        dense, sparse = await asyncio.gather(*[
+            client.search(collection_name=self.vector_store.collection_name, output_fields=["parent_id"], **params)
+            for params in self._search_params(query_embeddings, c, subjects)])
+        bm25_hits = await asyncio.to_thread(self._bm25_hits, query)
+        return self._fuse(dense[0], sparse[0], bm25_hits, k)
+
+    async def asearch(self, query, c=configs.c, k=configs.k, subjects=None):
+        fused = await self.asearch_hits(query, c, k, subjects)
+        parent_ids, faq_ids = self._split_ids(fused)
+        parents, faqs = await asyncio.gather(ParentManager.aget_parent_map(parent_ids),
+                                             QuestionManager.aget_faqs_by_ids(faq_ids))
+        return self._to_docs(fused, parents, faqs)
@@ -0,0 +1,79 @@
+from concurrent.futures import Future
+import asyncio
+import queue
+import threading
+import time
+
+
+class EmbeddingBatcher:
+    """
+    查询向量的动态微批处理
+    并发请求先进入队列，后台线程最多等待max_wait秒凑满max_batch条后一次性调用嵌入模型，
+    再把每条的稠密/稀疏向量分发回各自的调用方，CPU上一次batch前向远比多次单条前向划算
+    """
+
+    def __init__(self, embedding_function, max_batch=16, max_wait=0.005):
+        """
+        :param embedding_function: BGEM3EmbeddingFunction 实例, 输入文本列表, 返回 {"dense":..., "sparse":...}
+        :param max_batch: 单批最大条数
+        :param max_wait: 凑批的最长等待时间（秒）
+        """
+        self.embedding_function = embedding_function
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.worker = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, text):
+        future = Future()
+        self.queue.put((text, future))
+        return future
+
+    # 同步调用 返回与 embedding_function([text]) 相同结构的结果
+    def embed(self, text):
+        return self.submit(text).result()
+
+    async def aembed(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    # 取一批: 阻塞等第一条, 之后在截止时间内尽量多取
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            # 同一批里相同的文本只算一次
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                embeddings = self.embedding_function(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            rows = {text: i for i, text in enumerate(texts)}
+            for text, future in batch:
+                i = rows[text]
+                future.set_result({
+                    "dense": [embeddings["dense"][i]],
+                    "sparse": embeddings["sparse"][i:i + 1]
+                })
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": self.items / self.batches if self.batches else 0.0}
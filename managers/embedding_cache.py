@@ -0,0 +1,98 @@
+from scipy import sparse
+from utils.general_utils.globle_util import gen_hash
+from utils.general_utils.lru_cache import LRUCache
+import numpy as np
+import unicodedata
+import base64
+
+
+# 归一化查询: 全角转半角、转小写、合并空白
+def normalize_query(query):
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+
+class EmbeddingCache:
+    """
+    查询向量缓存 normalized query -> (稠密向量, 稀疏向量)
+    进程内为有界LRU+TTL, 每条只存float32稠密数组和稀疏的 indices/values 两个数组;
+    传入RedisClient时作为二级缓存, 多个worker共享
+    """
+
+    def __init__(self, max_entries=10000, ex=3600, redis_client=None):
+        """
+        :param max_entries: 进程内最大条数
+        :param ex: 过期时间（秒）
+        :param redis_client: conn.redis_conn.RedisClient 实例 可选
+        """
+        self.ex = ex
+        self.redis = redis_client
+        # norm -> (稠密向量, 稀疏indices, 稀疏values, 稀疏维度)
+        self.local = LRUCache(max_entries, ex)
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _key(self, norm):
+        return f"emb:{gen_hash(norm)}"
+
+    def get(self, query):
+        """
+        :param query: 用户问题
+        :return: 与 embedding_function([query]) 相同结构的结果 或 None
+        """
+        norm = normalize_query(query)
+        entry = self.local.get(norm)
+        if entry is not None:
+            return self._to_embeddings(entry)
+        if self.redis is not None:
+            data = self.redis.client.hgetall(self._key(norm))
+            if data:
+                entry = (
+                    np.frombuffer(base64.b64decode(data["dense"]), dtype=np.float32),
+                    np.frombuffer(base64.b64decode(data["indices"]), dtype=np.int32),
+                    np.frombuffer(base64.b64decode(data["values"]), dtype=np.float32),
+                    int(data["dim"])
+                )
+                self.local.set(norm, entry)
+                self.redis_hits += 1
+                return self._to_embeddings(entry)
+        self.misses += 1
+        return None
+
+    def set(self, query, embeddings):
+        """
+        :param query: 用户问题
+        :param embeddings: embedding_function([query]) 的结果
+        """
+        norm = normalize_query(query)
+        row = embeddings["sparse"][0:1].tocsr()
+        entry = (
+            np.asarray(embeddings["dense"][0], dtype=np.float32),
+            row.indices.astype(np.int32),
+            row.data.astype(np.float32),
+            int(row.shape[1])
+        )
+        self.local.set(norm, entry)
+        if self.redis is not None:
+            key = self._key(norm)
+            pipe = self.redis.client.pipeline()
+            pipe.hset(key, mapping={
+                "dense": base64.b64encode(entry[0].tobytes()).decode(),
+                "indices": base64.b64encode(entry[1].tobytes()).decode(),
+                "values": base64.b64encode(entry[2].tobytes()).decode(),
+                "dim": entry[3]
+            })
+            pipe.expire(key, self.ex)
+            pipe.execute()
+
+    @staticmethod
+    def _to_embeddings(entry):
+        dense, indices, values, dim = entry
+        row = sparse.csr_array((values, indices, np.array([0, len(indices)])), shape=(1, dim))
+        return {"dense": [dense], "sparse": row}
+
+    def stats(self):
+        hits = self.local.hits
+        total = hits + self.redis_hits + self.misses
+        return {"hits": hits, "redis_hits": self.redis_hits, "misses": self.misses,
+                "hit_rate": (hits + self.redis_hits) / total if total else 0.0,
+                "size": len(self.local)}
@@ -0,0 +1,59 @@
+# Milvus索引配置档 创建集合时按 index_profile 建索引, 检索时用同一档的搜索参数
+# 切换配置档后需要对已有集合执行 VectorStore.rebuild_index()
+
+# 当前使用的配置档
+index_profile = "ivf_flat"
+
+# 稀疏向量 建索引时丢弃低权重比例 / 检索时丢弃查询中低权重比例
+SPARSE_INDEX = {"index_type": "SPARSE_INVERTED_INDEX", "params": {"drop_ratio_build": 0.2}}
+SPARSE_SEARCH = {"drop_ratio_search": 0.0}
+
+# dense_index: 建索引参数 dense_search: 检索参数 sweep: 调参时扫描的检索参数
+INDEX_PROFILES = {
+    "ivf_flat": {
+        "dense_index": {"index_type": "IVF_FLAT", "params": {"nlist": 128}},
+        "dense_search": {"nprobe": 10},
+        "sweep": {"nprobe": [1, 4, 8, 10, 16, 32, 64, 128]},
+    },
+    "hnsw": {
+        "dense_index": {"index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}},
+        "dense_search": {"ef": 64},
+        "sweep": {"ef": [16, 32, 64, 128, 256, 512]},
+    },
+    "ivf_pq": {
+        # m需要整除向量维度 BGE-M3为1024
+        "dense_index": {"index_type": "IVF_PQ", "params": {"nlist": 256, "m": 64, "nbits": 8}},
+        "dense_search": {"nprobe": 16},
+        "sweep": {"nprobe": [4, 8, 16, 32, 64, 128]},
+    },
+    "scann": {
+        "dense_index": {"index_type": "SCANN", "params": {"nlist": 256, "with_raw_data": True}},
+        "dense_search": {"nprobe": 16, "reorder_k": 100},
+        "sweep": {"nprobe": [4, 8, 16, 32, 64], "reorder_k": [50, 100, 200]},
+    },
+    "diskann": {
+        "dense_index": {"index_type": "DISKANN", "params": {}},
+        "dense_search": {"search_list": 100},
+        "sweep": {"search_list": [20, 50, 100, 200, 400]},
+    },
+}
+
+
+def get_profile(name=None):
+    name = name or index_profile
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"未知的索引配置档:{name} 可选:{list(INDEX_PROFILES)}")
+    profile = dict(INDEX_PROFILES[name])
+    profile.setdefault("sparse_index", SPARSE_INDEX)
+    profile.setdefault("sparse_search", SPARSE_SEARCH)
+    return profile
+
+
+def sweep_grid(name=None):
+    """
+    :return: 配置档的检索参数组合列表 如 [{"nprobe": 4, "reorder_k": 50}, ...]
+    """
+    grid = [{}]
+    for key, values in get_profile(name)["sweep"].items():
+        grid = [dict(params, **{key: value}) for params in grid for value in values]
+    return grid
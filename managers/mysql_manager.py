@@ -1,9 +1,15 @@
 
 from conn import mysql_conn as MC
+from utils.general_utils.lru_cache import LRUCache
 import datetime
 from uuid import uuid4
 
-mc = MC.MysqlConn()
+# 线程安全的连接池 并发请求各自借用连接
+mc = MC.PooledMysqlConn()
+amc = MC.AsyncMysqlConn()
+# 热点父文档缓存条数
+parent_cache_size = 2048
+parent_cache = LRUCache(parent_cache_size)
 
 
 class QuestionManager:
@@ -12,12 +18,57 @@ class QuestionManager:
     def get_all_questions():
         resutls = mc.searh_all("jpkb",["question"])
         return [result['question'] for result in resutls]
+
+    # 带主键的问题 供BM25索引与问题id对齐
+    @staticmethod
+    def get_all_question_rows():
+        return mc.searh_all("jpkb",["id","question"])
+
+    # 带学科的问答 供学科分类器训练
+    @staticmethod
+    def get_subject_rows():
+        return mc.searh_all("jpkb",["subject_name","question","answer"])
+
+    # jpkb表的校验和 表内容变化时才会变
+    @staticmethod
+    def get_checksum():
+        results = mc.search_by_sql("CHECKSUM TABLE jpkb")
+        if not results or results[0]['Checksum'] is None:
+            return None
+        return str(results[0]['Checksum'])
     @staticmethod
     def get_anwear_by_question(question):
         sql = 'select answer from jpkb where question =%s'
         params = (question,)
         results = mc.search_with_params(sql, params)
         return results[0]['answer'] if results else None
+
+    # 按主键批量取问答 一次查询
+    @staticmethod
+    def get_faqs_by_ids(ids):
+        """
+        :param ids: 问题主键列表
+        :return: {id: {'id':..., 'question':..., 'answer':...}}
+        """
+        if not ids:
+            return {}
+        sql = 'select id,question,answer from jpkb where id in (%s)' % ','.join(['%s'] * len(ids))
+        results = mc.search_with_params(sql, tuple(ids))
+        return {result['id']: result for result in results}
+
+    @staticmethod
+    async def aget_faqs_by_ids(ids):
+        if not ids:
+            return {}
+        sql = 'select id,question,answer from jpkb where id in (%s)' % ','.join(['%s'] * len(ids))
+        results = await amc.search_with_params(sql, tuple(ids))
+        return {result['id']: result for result in results}
+
+    @staticmethod
+    async def aget_anwear_by_question(question):
+        sql = 'select answer from jpkb where question =%s'
+        results = await amc.search_with_params(sql, (question,))
+        return results[0]['answer'] if results else None
 class MemeryManager:
 
     # 插入会话记录
@@ -26,29 +77,165 @@ class MemeryManager:
         d = {'question':question,'answer':answer,'session_id':session_id,'create_time':datetime.datetime.now(),'state':1}
         mc.insert('conversation',d)
 
+    # 批量插入会话记录 行的字段与insert_memery一致
+    @staticmethod
+    def insert_memeries(rows):
+        mc.insert('conversation',rows)
+
+    @staticmethod
+    async def ainsert_memery(question,answer,session_id):
+        d = {'question':question,'answer':answer,'session_id':session_id,'create_time':datetime.datetime.now(),'state':1}
+        await amc.insert('conversation',d)
+
 
     # 仅返回一个会话id
     @staticmethod
     def new_session():
         return str(uuid4())
 
+    # 最近k轮的原始记录 按时间倒序
+    @staticmethod
+    def get_recent_rows(session_id,k=3):
+        sql = 'select id,question,answer,create_time from conversation where session_id =%s and state=1 order by create_time desc limit %s'
+        params = (session_id,k)
+        return mc.search_with_params(sql, params)
+
     # 根据session_id得到前k个聊天历史并拼接一下返回
     @staticmethod
     def search_history(session_id,k=3):
+        return MemeryManager._format_history(MemeryManager.get_recent_rows(session_id,k))
+
+    @staticmethod
+    async def asearch_history(session_id,k=3):
         sql = 'select question,answer from conversation where session_id =%s and state=1 order by create_time desc limit %s'
-        params = (session_id,k)
-        historys = mc.search_with_params(sql, params)
+        historys = await amc.search_with_params(sql, (session_id,k))
+        return MemeryManager._format_history(historys)
+
+    # 拼接聊天历史
+    @staticmethod
+    def _format_history(historys):
         s = ''
         for history in historys:
             s += f"问题:{history['question']}。回答：{history['answer']}\n"
         return s
 
+    # 会话滚动摘要表 每个会话一行
+    # turn_time: 已并入摘要的最新一轮的时间戳 之后的轮次仍需原样带上; version: 多个worker并发更新时做比较并交换
+    @staticmethod
+    def create_summary_table():
+        mc.execute('create table if not exists conversation_summary ('
+                   'session_id varchar(64) primary key,'
+                   'summary text not null,'
+                   'turn_time double not null default 0,'
+                   'version int not null default 0,'
+                   'update_time datetime not null)')
+
+    @staticmethod
+    def get_summary(session_id):
+        """:return: {'summary':..., 'turn_time':..., 'version':...} 或 None"""
+        results = mc.search_with_params('select summary,turn_time,version from conversation_summary '
+                                        'where session_id=%s', (session_id,))
+        return results[0] if results else None
+
+    @staticmethod
+    def cas_summary(session_id,summary,turn_time,version):
+        """
+        版本号仍为version时才写入 version为0表示还没有摘要
+        :return: 是否写入成功 失败说明其它worker先更新了 需重新读取再合并
+        """
+        now = datetime.datetime.now()
+        if not version:
+            sql = ('insert ignore into conversation_summary (session_id,summary,turn_time,version,update_time) '
+                   'values (%s,%s,%s,1,%s)')
+            return mc.execute(sql,(session_id,summary,turn_time,now)) == 1
+        sql = ('update conversation_summary set summary=%s,turn_time=%s,version=version+1,update_time=%s '
+               'where session_id=%s and version=%s')
+        return mc.execute(sql,(summary,turn_time,now,session_id,version)) == 1
+
+    @staticmethod
+    def delete_summary(session_id):
+        mc.execute('delete from conversation_summary where session_id=%s',(session_id,))
+
     # 根据session_id清空会话记录,将状态改为0
     @staticmethod
     def clear_memery(session_id):
-        sql = 'update conversation set state=0 where se  ="%s"' % session_id
-        mc.execute(sql)
+        mc.execute('update conversation set state=0 where session_id=%s',(session_id,))
+
+
+
+# 父文档表：父块只存一份，milvus中的子块只保留parent_id
+class ParentManager:
+
+    @staticmethod
+    def create_table():
+        mc.execute('create table if not exists parent_doc ('
+                   'id varchar(64) primary key,'
+                   'content mediumtext not null,'
+                   'source varchar(256),'
+                   'index idx_source (source))')
 
+    # 批量写入父文档 已存在则覆盖
+    @staticmethod
+    def upsert_parents(parents):
+        """
+        :param parents: 字典列表 [{'id':..., 'content':..., 'source':...}]
+        """
+        sql = ('insert into parent_doc (id,content,source) values (%s,%s,%s) '
+               'on duplicate key update content=values(content),source=values(source)')
+        mc.execute_many(sql, [(p['id'], p['content'], p['source']) for p in parents])
+        for p in parents:
+            parent_cache.delete(p['id'])
+
+    # 删除某个文件下不再使用的父文档
+    @staticmethod
+    def delete_stale(source, keep_ids):
+        keep_ids = list(keep_ids)
+        sql = 'delete from parent_doc where source=%s'
+        if keep_ids:
+            sql += ' and id not in (%s)' % ','.join(['%s'] * len(keep_ids))
+        mc.execute_many(sql, [(source, *keep_ids)])
+        # 只能清本进程 在线服务的父文档缓存由检索索引版本号变化时清空 见RetrievalCache.add_listener
+        ParentManager.clear_cache()
+
+    @staticmethod
+    def clear_cache():
+        parent_cache.clear()
+
+    # 按id取父文档内容 先查LRU 未命中的一次批量查询
+    @staticmethod
+    def get_parent_map(ids):
+        """
+        :param ids: 父文档id列表
+        :return: {id: content} 不存在的id不在结果中
+        """
+        found, missing = parent_cache.get_many(ids)
+        if missing:
+            sql = 'select id,content from parent_doc where id in (%s)' % ','.join(['%s'] * len(missing))
+            for row in mc.search_with_params(sql, tuple(missing)):
+                parent_cache.set(row['id'], row['content'])
+                found[row['id']] = row['content']
+        return found
+
+    @staticmethod
+    async def aget_parent_map(ids):
+        found, missing = parent_cache.get_many(ids)
+        if missing:
+            sql = 'select id,content from parent_doc where id in (%s)' % ','.join(['%s'] * len(missing))
+            for row in await amc.search_with_params(sql, tuple(missing)):
+                parent_cache.set(row['id'], row['content'])
+                found[row['id']] = row['content']
+        return found
+
+    # 按id顺序返回父文档内容
+    @staticmethod
+    def get_parents(ids):
+        found = ParentManager.get_parent_map(ids)
+        return [found[i] for i in ids if i in found]
+
+    @staticmethod
+    async def aget_parents(ids):
+        found = await ParentManager.aget_parent_map(ids)
+        return [found[i] for i in ids if i in found]
 
 
 if __name__ == '__main__':
@@ -1,7 +1,18 @@
 from conn import redis_conn
+from utils.general_utils.globle_util import gen_hash
+from utils.general_utils.lru_cache import LRUCache
+from utils.general_utils.loggers import logger
+import numpy as np
+import threading
+import base64
+import time
+import redis
 
 R = redis_conn.RedisClient()
 ttl = 86400 # 24小时
+# 语义缓存：余弦相似度阈值与最大条目数
+semantic_threshold = 0.92
+semantic_max_entries = 5000
 
 class QuestionCache:
 
@@ -29,4 +40,175 @@ class AnswerCache:
         return R.client.get(f"answer:{query}")
 
 
+class SemanticAnswerCache:
+    """
+    语义答案缓存：按查询向量的余弦相似度命中，换个说法问同一个问题也能直接返回
+    redis中每条缓存是一个hash(answer, vec)并带过期时间，有序集合记录最近访问时间用于LRU淘汰，
+    每次写入/淘汰递增版本号，本进程只在版本号变化时同步向量镜像
+    redis不可用时退化为进程内的LRU缓存
+    """
+    prefix = "semantic"
 
+    def __init__(self, embed_fn, threshold=semantic_threshold, max_entries=semantic_max_entries, ex=ttl):
+        """
+        :param embed_fn: 查询 -> 稠密向量 的函数
+        :param threshold: 命中所需的最低余弦相似度
+        :param max_entries: 最大缓存条数 超出后淘汰最久未访问的
+        :param ex: 过期时间（秒）
+        """
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ex = ex
+        self.use_redis = self._redis_available()
+        # 进程内模式: id -> (向量, 答案) 的LRU缓存
+        self.local = LRUCache(max_entries, ex)
+        # redis模式: id -> 向量 的镜像 答案、过期时间与LRU顺序以redis为准
+        self.mirror = {}
+        self._ids = []
+        self._matrix = None
+        self._expires = None
+        self._version = None
+        # 保护镜像矩阵 以及对 self.local.entries 的遍历
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _redis_available():
+        try:
+            return R.client.ping()
+        except redis.exceptions.RedisError:
+            logger.info("redis不可用，语义缓存使用进程内存储")
+            return False
+
+    def _key(self, name):
+        return f"{self.prefix}:{name}"
+
+    def _embed(self, query):
+        vec = np.asarray(self.embed_fn(query), dtype=np.float32)
+        return vec / (np.linalg.norm(vec) + 1e-12)
+
+    # ------------------ 读 ------------------
+    def get(self, query):
+        """
+        :param query: 用户问题
+        :return: 命中的答案 或 None
+        """
+        vec = self._embed(query)
+        with self._lock:
+            if self.use_redis:
+                self._sync()
+            candidates = self._nearest(vec)
+        # 最近的一条可能刚过期/被淘汰 依次尝试阈值以上的其它条目
+        answer = None
+        for entry_id in candidates:
+            answer = self._get_entry(entry_id)
+            if answer is not None:
+                break
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    # (id, 向量, 过期时间) redis模式下过期时间以redis为准 这里为None
+    def _vectors(self):
+        if self.use_redis:
+            return ((i, vec, None) for i, vec in self.mirror.items())
+        return ((i, entry[0][0], entry[1]) for i, entry in self.local.entries.items())
+
+    def _nearest(self, vec):
+        """
+        :return: 相似度达到阈值的条目id 按相似度降序 进程内模式下已过期的条目不参与比较
+        """
+        if self._matrix is None:
+            vectors = list(self._vectors())
+            if not vectors:
+                return []
+            self._ids = [i for i, _, _ in vectors]
+            self._matrix = np.stack([v for _, v, _ in vectors])
+            self._expires = np.array([np.inf if e is None else e for _, _, e in vectors])
+        sims = self._matrix @ vec
+        sims[self._expires < time.time()] = -np.inf
+        order = np.flatnonzero(sims >= self.threshold)
+        order = order[np.argsort(-sims[order], kind="stable")]
+        return [self._ids[i] for i in order]
+
+    def _get_entry(self, entry_id):
+        if not self.use_redis:
+            with self._lock:
+                entry = self.local.get(entry_id)
+                if entry is None:
+                    # 已过期或被淘汰 下次查询重建矩阵
+                    self._matrix = None
+                    return None
+                return entry[1]
+        answer = R.client.hget(self._key(f"entry:{entry_id}"), "answer")
+        if answer is None:
+            # 已过期 从LRU集合里清掉并通知其他进程
+            pipe = R.client.pipeline()
+            pipe.zrem(self._key("lru"), entry_id)
+            pipe.incr(self._key("version"))
+            pipe.execute()
+            return None
+        R.client.zadd(self._key("lru"), {entry_id: time.time()})
+        return answer
+
+    # 版本号变化时从redis同步向量镜像
+    def _sync(self):
+        version = R.client.get(self._key("version"))
+        if version == self._version:
+            return
+        ids = R.client.zrange(self._key("lru"), 0, -1)
+        missing = [i for i in ids if i not in self.mirror]
+        if missing:
+            pipe = R.client.pipeline()
+            for i in missing:
+                pipe.hget(self._key(f"entry:{i}"), "vec")
+            for i, vec in zip(missing, pipe.execute()):
+                if vec is not None:
+                    self.mirror[i] = np.frombuffer(base64.b64decode(vec), dtype=np.float32)
+        self.mirror = {i: self.mirror[i] for i in ids if i in self.mirror}
+        self._matrix = None
+        self._version = version
+
+    # ------------------ 写 ------------------
+    def set(self, query, answer):
+        """
+        :param query: 用户问题
+        :param answer: 完整答案
+        """
+        if not answer:
+            return
+        vec = self._embed(query)
+        entry_id = gen_hash(query)
+        if self.use_redis:
+            self._set_redis(entry_id, vec, answer)
+            return
+        with self._lock:
+            self.local.set(entry_id, (vec, answer))
+            self._matrix = None
+
+    def _set_redis(self, entry_id, vec, answer):
+        key = self._key(f"entry:{entry_id}")
+        pipe = R.client.pipeline()
+        pipe.hset(key, mapping={"answer": answer, "vec": base64.b64encode(vec.tobytes()).decode()})
+        pipe.expire(key, self.ex)
+        pipe.zadd(self._key("lru"), {entry_id: time.time()})
+        pipe.expire(self._key("lru"), self.ex)
+        pipe.incr(self._key("version"))
+        pipe.zcard(self._key("lru"))
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            # 淘汰最久未访问的条目
+            evicted = R.client.zpopmin(self._key("lru"), size - self.max_entries)
+            pipe = R.client.pipeline()
+            for evicted_id, _ in evicted:
+                pipe.delete(self._key(f"entry:{evicted_id}"))
+            pipe.incr(self._key("version"))
+            pipe.execute()
+
+    def stats(self):
+        size = len(self.mirror) if self.use_redis else len(self.local)
+        return {"hits": self.hits, "misses": self.misses, "size": size}
@@ -0,0 +1,123 @@
+from managers.embedding_cache import normalize_query
+from utils.general_utils.globle_util import gen_hash
+from utils.general_utils.lru_cache import LRUCache
+from utils.general_utils.loggers import logger
+import threading
+import redis
+import json
+import time
+
+# 多worker共享版本号时 本地缓存的版本号多久去redis确认一次（秒）
+version_check_interval = 1.0
+
+
+class RetrievalCache:
+    """
+    检索结果缓存 (归一化查询, 检索参数) -> 有序的 [(父文档id, 得分)]
+    缓存key里带集合的索引版本号, 入库/删除/重建索引时递增版本号, 旧结果立即失效;
+    redis可用时版本号始终放在redis, 离线入库进程递增后在线服务最多 version_check_interval 秒内失效,
+    redis不可用时退化为进程内版本号(离线入库后最长陈旧 ex 秒);
+    结果默认只存进程内LRU+TTL, share_results=True 时也写入redis供多个worker共享
+    """
+    version_key = "retrieval:index_version"
+
+    def __init__(self, max_entries=10000, ex=600, redis_client=None, share_results=False):
+        """
+        :param max_entries: 进程内最大条数
+        :param ex: 过期时间（秒）
+        :param redis_client: conn.redis_conn.RedisClient 实例 可选 ping不通时不使用
+        :param share_results: 检索结果是否也放在redis
+        """
+        self.ex = ex
+        self.redis = redis_client if redis_client is not None and self._redis_available(redis_client) else None
+        self.share_results = share_results and self.redis is not None
+        self.local = LRUCache(max_entries, ex)
+        self._lock = threading.Lock()
+        self._version = 0
+        self._version_checked = 0.0
+        self.redis_hits = 0
+        # 观察到其它进程递增版本号时的回调 用于清空依赖索引内容的其它进程内缓存
+        self.listeners = []
+
+    @staticmethod
+    def _redis_available(redis_client):
+        try:
+            return redis_client.client.ping()
+        except redis.exceptions.RedisError:
+            logger.info("redis不可用，检索缓存的索引版本号只在进程内有效")
+            return False
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    # 当前索引版本号 有redis时按间隔刷新
+    def version(self):
+        if self.redis is None:
+            return self._version
+        now = time.time()
+        if now - self._version_checked >= version_check_interval:
+            try:
+                value = int(self.redis.client.get(self.version_key) or 0)
+            except redis.exceptions.RedisError as e:
+                logger.error(f"读取检索索引版本号失败:{e}")
+                return self._version
+            with self._lock:
+                changed = value != self._version
+                self._version = value
+                self._version_checked = now
+            if changed:
+                # 其它进程(如离线入库)改了集合 本进程依赖旧内容的缓存一并清空
+                self.local.clear()
+                for callback in self.listeners:
+                    callback()
+        return self._version
+
+    def bump_version(self):
+        """集合内容变化后调用 之前缓存的结果全部失效"""
+        with self._lock:
+            try:
+                if self.redis is None:
+                    raise redis.exceptions.ConnectionError("redis不可用")
+                self._version = int(self.redis.client.incr(self.version_key))
+                self._version_checked = time.time()
+            except redis.exceptions.RedisError as e:
+                if self.redis is not None:
+                    logger.error(f"递增检索索引版本号失败 只在本进程失效:{e}")
+                self._version += 1
+            version = self._version
+        self.local.clear()
+        return version
+
+    def _key(self, query, params):
+        norm = normalize_query(query)
+        return f"retrieval:{self.version()}:{gen_hash(norm + json.dumps(params, sort_keys=True, ensure_ascii=False))}"
+
+    def get(self, query, params):
+        """
+        :param params: 影响检索结果的参数 如 {"c": 10, "subjects": [...]}
+        :return: [(父文档id, 得分)] 或 None
+        """
+        key = self._key(query, params)
+        hits = self.local.get(key)
+        if hits is not None:
+            return hits
+        if self.share_results:
+            data = self.redis.client.get(key)
+            if data:
+                hits = [tuple(hit) for hit in json.loads(data)]
+                self.local.set(key, hits)
+                self.redis_hits += 1
+                return hits
+        return None
+
+    def set(self, query, params, hits):
+        key = self._key(query, params)
+        hits = [(parent_id, float(score)) for parent_id, score in hits]
+        self.local.set(key, hits)
+        if self.share_results:
+            self.redis.client.set(key, json.dumps(hits, ensure_ascii=False), ex=self.ex)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update(redis_hits=self.redis_hits, version=self._version)
+        return stats
@@ -0,0 +1,347 @@
+from managers.mysql_manager import MemeryManager
+from managers.redis_manager import R
+from managers.session_summarizer import SessionSummarizer
+from utils.general_utils.loggers import logger
+from collections import OrderedDict, deque
+from uuid import uuid4
+import threading
+import datetime
+import asyncio
+import atexit
+import queue
+import json
+import time
+import redis
+
+# 每个会话在热存储里保留的最近轮数 需不小于展示历史的轮数
+hot_turns = 10
+# redis中会话热数据的过期时间（秒）
+session_ttl = 86400
+# redis不可用时 进程内最多保留多少个会话
+local_max_sessions = 10000
+# 冷加载锁的过期时间（秒） 持有锁的进程中途退出时 过期后其它请求可以重新加载
+load_lock_ttl = 30
+# 写回mysql: 单批最大条数、最长攒批时间（秒）、失败重试次数
+flush_batch = 64
+flush_interval = 1.0
+flush_retries = 3
+# 是否在后台维护每个会话的滚动摘要 开启后历史只带 摘要+还没并入摘要的轮次
+summary_enabled = True
+
+
+class SessionMemory:
+    """
+    会话记忆的热层: 每个session最近 hot_turns 轮放在redis列表(不可用时为进程内环形缓冲),
+    读历史不再查mysql; 新的一轮先写热层, 再由后台线程攒批写回mysql的conversation表(写后回写)
+    接口与MemeryManager一致, 可直接替换
+    开启摘要时 每轮结束后由SessionSummarizer在后台更新会话摘要, 历史只返回 摘要+摘要之后的轮次, 长度不随会话增长
+    """
+    prefix = "session"
+
+    def __init__(self, max_turns=hot_turns, ex=session_ttl):
+        self.max_turns = max_turns
+        self.ex = ex
+        self.use_redis = self._redis_available()
+        # session_id -> deque(最新在前) 只在没有redis时使用
+        self.local = OrderedDict()
+        # session_id -> (摘要, 已并入的最新一轮时间戳) 只在没有redis时使用 摘要为''表示mysql里也没有
+        self.summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        # session_id -> {记录id: 轮次} 还在写回队列里没落库的轮次 冷加载时与mysql的结果合并
+        self._unflushed = {}
+        self._stopped = threading.Event()
+        self.flushed = 0
+        self.dropped = 0
+        self._worker = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+        self._worker.start()
+        self.summarizer = None
+        if summary_enabled:
+            MemeryManager.create_summary_table()
+            self.summarizer = SessionSummarizer(self)
+        atexit.register(self.close)
+
+    @staticmethod
+    def _redis_available():
+        try:
+            return R.client.ping()
+        except redis.exceptions.RedisError:
+            logger.info("redis不可用，会话记忆使用进程内存储")
+            return False
+
+    def _key(self, session_id):
+        return f"{self.prefix}:{session_id}"
+
+    def _loaded_key(self, session_id):
+        return f"{self.prefix}:loaded:{session_id}"
+
+    # 冷加载锁 并发的首次请求只有一个写热层
+    def _loading_key(self, session_id):
+        return f"{self.prefix}:loading:{session_id}"
+
+    def _summary_key(self, session_id):
+        return f"{self.prefix}:summary:{session_id}"
+
+    # ------------------ 热层 ------------------
+    def _push(self, session_id, turns):
+        """:param turns: 按时间正序的 [{'question':..., 'answer':..., 'ts':..., 'id':...}]"""
+        if self.use_redis:
+            key = self._key(session_id)
+            pipe = R.client.pipeline()
+            for turn in turns:
+                pipe.lpush(key, json.dumps(turn, ensure_ascii=False))
+            pipe.ltrim(key, 0, self.max_turns - 1)
+            pipe.expire(key, self.ex)
+            # 只续期 不设置: 已加载标记只由冷加载的赢家设置 否则新写入的一轮会挡住历史的加载
+            pipe.expire(self._loaded_key(session_id), self.ex)
+            pipe.execute()
+            return
+        with self._lock:
+            turns_deque = self.local.get(session_id)
+            if turns_deque is None:
+                # 还没加载(或已被LRU淘汰)的会话不建半截的热数据 这一轮留在_unflushed里 下次冷加载时合并
+                return
+            for turn in turns:
+                turns_deque.appendleft(turn)
+            self.local.move_to_end(session_id)
+            while len(self.local) > local_max_sessions:
+                self.local.popitem(last=False)
+
+    # 热层中最近k轮 热层没有这个会话时返回None
+    def _recent_hot(self, session_id, k):
+        if self.use_redis:
+            pipe = R.client.pipeline()
+            pipe.exists(self._loaded_key(session_id))
+            pipe.lrange(self._key(session_id), 0, k - 1)
+            loaded, items = pipe.execute()
+            return [json.loads(item) for item in items] if loaded else None
+        with self._lock:
+            turns = self.local.get(session_id)
+            if turns is None:
+                return None
+            self.local.move_to_end(session_id)
+            return list(turns)[:k]
+
+    def recent_turns(self, session_id, k=3):
+        """
+        :return: 最近k轮 按时间倒序 [{'question':..., 'answer':..., 'ts': 时间戳, 'id': 记录id}]
+        """
+        turns = self._recent_hot(session_id, k)
+        if turns is not None:
+            return turns
+        # 热层没有(新会话/重启/过期/被LRU淘汰) 从mysql加载一次 之后都走热层
+        return self._cold_load(session_id)[:k]
+
+    # 同一轮可能同时出现在热层、mysql和写回队列里 按记录id去重
+    @staticmethod
+    def _turn_key(turn):
+        return turn.get('id') or turn['ts']
+
+    def _merge_turns(self, *sources):
+        merged = {}
+        for turns in sources:
+            for turn in turns:
+                merged.setdefault(self._turn_key(turn), turn)
+        return sorted(merged.values(), key=lambda turn: turn['ts'], reverse=True)[:self.max_turns]
+
+    def _cold_load(self, session_id):
+        """
+        mysql中的最近轮次 + 还没写回的轮次 + 热层里已有的轮次 合并后写回热层
+        :return: 合并后的最近 max_turns 轮 按时间倒序
+        """
+        # 先取未写回的轮次再查mysql: 两步之间刚写回的轮次一定出现在其中之一
+        with self._lock:
+            unflushed = list(self._unflushed.get(session_id, {}).values())
+        rows = MemeryManager.get_recent_rows(session_id, self.max_turns)
+        loaded = [{'question': row['question'], 'answer': row['answer'], 'ts': row['create_time'].timestamp(),
+                   'id': row['id']} for row in rows]
+        if self.use_redis:
+            key = self._key(session_id)
+            hot = [json.loads(item) for item in R.client.lrange(key, 0, -1)]
+            merged = self._merge_turns(hot, unflushed, loaded)
+            # 并发的首次请求用SET NX抢加载锁 只有赢家写热层 其余只返回合并结果 避免重复写入
+            if R.client.set(self._loading_key(session_id), 1, nx=True, ex=load_lock_ttl):
+                # 比热层最早一轮还早的轮次追加到列表尾部 不会和并发写入的新一轮交错
+                hot_keys = {self._turn_key(turn) for turn in hot}
+                oldest = min((turn['ts'] for turn in hot), default=float('inf'))
+                older = [turn for turn in merged if self._turn_key(turn) not in hot_keys and turn['ts'] <= oldest]
+                pipe = R.client.pipeline()
+                if older:
+                    pipe.rpush(key, *[json.dumps(turn, ensure_ascii=False) for turn in older])
+                pipe.ltrim(key, 0, self.max_turns - 1)
+                pipe.expire(key, self.ex)
+                # 列表写完才设置已加载标记 读到标记的请求一定看到完整的热层
+                pipe.set(self._loaded_key(session_id), 1, ex=self.ex)
+                pipe.delete(self._loading_key(session_id))
+                pipe.execute()
+            return merged
+        with self._lock:
+            # 并发的冷加载与加载期间的新写入都合并进同一个deque 重复执行也不会重复
+            existing = self.local.get(session_id, ())
+            merged = self._merge_turns(existing, unflushed, loaded)
+            self.local[session_id] = deque(merged, maxlen=self.max_turns)
+            self.local.move_to_end(session_id)
+            while len(self.local) > local_max_sessions:
+                self.local.popitem(last=False)
+        return merged
+
+    async def arecent_turns(self, session_id, k=3):
+        return await asyncio.to_thread(self.recent_turns, session_id, k)
+
+    # ------------------ 滚动摘要 ------------------
+    def cache_summary(self, session_id, summary, turn_time):
+        if self.use_redis:
+            R.client.set(self._summary_key(session_id), json.dumps([summary, turn_time], ensure_ascii=False),
+                         ex=self.ex)
+            return
+        with self._lock:
+            self.summaries[session_id] = (summary, turn_time)
+            self.summaries.move_to_end(session_id)
+            while len(self.summaries) > local_max_sessions:
+                self.summaries.popitem(last=False)
+
+    def get_summary(self, session_id):
+        """:return: (会话摘要, 已并入摘要的最新一轮时间戳) 没有摘要时为 (None, 0)"""
+        if self.use_redis:
+            cached = R.client.get(self._summary_key(session_id))
+            cached = tuple(json.loads(cached)) if cached else None
+        else:
+            with self._lock:
+                cached = self.summaries.get(session_id)
+        if cached is None:
+            row = MemeryManager.get_summary(session_id)
+            cached = (row["summary"], row["turn_time"]) if row else ('', 0)
+            self.cache_summary(session_id, *cached)
+        return (cached[0] or None), cached[1]
+
+    # 有摘要时为 还没并入摘要的轮次(至少最近一轮)+摘要 否则为最近k轮 按时间倒序
+    def _turns_and_summary(self, session_id, k):
+        summary, turn_time = self.get_summary(session_id) if self.summarizer else (None, 0)
+        if not summary:
+            return self.recent_turns(session_id, k), None
+        turns = self.recent_turns(session_id, self.max_turns)
+        # 摘要落后时(后台队列积压) 摘要之后的轮次全部原样带上
+        unsummarized = [turn for turn in turns if turn.get('ts', 0) > turn_time]
+        return unsummarized or turns[:1], summary
+
+    def history_items(self, session_id, k=3):
+        """
+        给上下文拼装器的历史 重要的在前
+        :return: 有摘要时为 [摘要之后的轮次..., 摘要文本] 否则为最近k轮
+        """
+        turns, summary = self._turns_and_summary(session_id, k)
+        return turns + [f"对话摘要:{summary}\n"] if summary else turns
+
+    async def ahistory_items(self, session_id, k=3):
+        return await asyncio.to_thread(self.history_items, session_id, k)
+
+    # ------------------ 与MemeryManager一致的接口 ------------------
+    def insert_memery(self, question, answer, session_id):
+        # conversation.create_time 是秒级DATETIME 热层时间戳与摘要水位也取整到秒,
+        # 冷加载后从mysql读回的时间与写入时完全一致 (同一会话的两轮之间至少隔一次生成 不会落在同一秒)
+        create_time = datetime.datetime.now().replace(microsecond=0)
+        turn_time = create_time.timestamp()
+        turn = {'question': question, 'answer': answer, 'ts': turn_time, 'id': str(uuid4())}
+        with self._lock:
+            self._unflushed.setdefault(session_id, {})[turn['id']] = turn
+        self._push(session_id, [turn])
+        self._pending.put({'question': question, 'answer': answer, 'session_id': session_id,
+                           'create_time': create_time, 'state': 1, 'id': turn['id']})
+        if self.summarizer is not None:
+            self.summarizer.submit(session_id, question, answer, turn_time)
+
+    async def ainsert_memery(self, question, answer, session_id):
+        if self.use_redis:
+            await asyncio.to_thread(self.insert_memery, question, answer, session_id)
+        else:
+            self.insert_memery(question, answer, session_id)
+
+    # 展示用的最近k轮原文 摘要只用于拼提示词(history_items)
+    def search_history(self, session_id, k=3):
+        return MemeryManager._format_history(self.recent_turns(session_id, k))
+
+    async def asearch_history(self, session_id, k=3):
+        return await asyncio.to_thread(self.search_history, session_id, k)
+
+    @staticmethod
+    def new_session():
+        return MemeryManager.new_session()
+
+    def clear_memery(self, session_id):
+        # 先把还没写回的记录落库 再清空; 只丢弃这个会话排队中的摘要 不等其它会话
+        self.flush()
+        if self.summarizer is not None:
+            self.summarizer.discard(session_id)
+        if self.use_redis:
+            R.client.delete(self._key(session_id), self._loaded_key(session_id), self._loading_key(session_id),
+                            self._summary_key(session_id))
+        else:
+            with self._lock:
+                self.local.pop(session_id, None)
+                self.summaries.pop(session_id, None)
+        MemeryManager.clear_memery(session_id)
+        if self.summarizer is not None:
+            MemeryManager.delete_summary(session_id)
+
+    # ------------------ 写回mysql ------------------
+    def _take_batch(self, timeout):
+        try:
+            batch = [self._pending.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + flush_interval
+        while len(batch) < flush_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            for attempt in range(flush_retries):
+                try:
+                    MemeryManager.insert_memeries(batch)
+                    self.flushed += len(batch)
+                    return
+                except Exception as e:
+                    logger.error(f"会话记录写回mysql失败({attempt + 1}/{flush_retries}):{e}")
+                    time.sleep(0.5 * 2 ** attempt)
+            self.dropped += len(batch)
+        finally:
+            self._forget_unflushed(batch)
+
+    def _forget_unflushed(self, batch):
+        with self._lock:
+            for row in batch:
+                turns = self._unflushed.get(row['session_id'])
+                if turns is not None:
+                    turns.pop(row['id'], None)
+                    if not turns:
+                        del self._unflushed[row['session_id']]
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            batch = self._take_batch(timeout=flush_interval)
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._pending.task_done()
+
+    # 等待已提交的记录全部写回
+    def flush(self):
+        self._pending.join()
+
+    def close(self):
+        self.flush()
+        self._stopped.set()
+
+    def stats(self):
+        stats = {"pending": self._pending.qsize(), "flushed": self.flushed, "dropped": self.dropped,
+                 "use_redis": bool(self.use_redis)}
+        if self.summarizer is not None:
+            stats["summary"] = self.summarizer.stats()
+        return stats
@@ -0,0 +1,97 @@
+from conn.llms import get_deepseek, get_ollama
+from managers.mysql_manager import MemeryManager
+from online.rag_system.prompts import RAGPrompts
+from langchain_core.output_parsers import StrOutputParser
+from utils.general_utils.loggers import logger
+import threading
+import queue
+
+# 生成摘要用的模型: "ollama" 本地小模型 / "deepseek"
+summary_llm = "ollama"
+# 摘要最大字数
+summary_max_chars = 500
+# 与其它worker并发更新同一会话摘要时的最大重试次数
+cas_retries = 3
+
+
+class SessionSummarizer:
+    """
+    后台滚动摘要: 每轮对话结束后把本轮问答放进队列,
+    由单个工作线程按提交顺序调用LLM把它并入会话摘要, 不占用请求链路;
+    摘要按版本号比较并交换写入mysql, 多个worker更新同一会话时不会互相覆盖
+    """
+
+    def __init__(self, memory, llm_name=summary_llm):
+        """
+        :param memory: managers.session_memory.SessionMemory 实例 用于更新热层中的摘要
+        :param llm_name: ollama / deepseek
+        """
+        self.memory = memory
+        llm = get_ollama() if llm_name == "ollama" else get_deepseek()
+        self.chain = RAGPrompts.summary_prompt() | llm | StrOutputParser()
+        self._queue = queue.Queue()
+        # session_id -> 代数 清空会话时加一 之前排队的任务直接跳过
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.updated = 0
+        self.failed = 0
+        self.skipped = 0
+        self._worker = threading.Thread(target=self._loop, name="session-summary", daemon=True)
+        self._worker.start()
+
+    def _generation(self, session_id):
+        with self._lock:
+            return self._generations.get(session_id, 0)
+
+    def submit(self, session_id, question, answer, turn_time):
+        """
+        :param turn_time: 本轮的时间戳 与热层中轮次的ts一致
+        """
+        self._queue.put((session_id, self._generation(session_id), question, answer, turn_time))
+
+    # 丢弃该会话已排队和正在生成的摘要 不影响其它会话
+    def discard(self, session_id):
+        with self._lock:
+            self._generations[session_id] = self._generations.get(session_id, 0) + 1
+
+    def summarize(self, session_id, question, answer, turn_time, generation=None):
+        for _ in range(cas_retries):
+            row = MemeryManager.get_summary(session_id) or {"summary": "", "turn_time": 0, "version": 0}
+            summary = self.chain.invoke({"summary": row["summary"] or "无",
+                                         "question": question, "answer": answer,
+                                         "max_chars": summary_max_chars})
+            summary = summary.strip()[:summary_max_chars]
+            if generation is not None and generation != self._generation(session_id):
+                return None
+            new_turn_time = max(row["turn_time"], turn_time)
+            if MemeryManager.cas_summary(session_id, summary, new_turn_time, row["version"]):
+                self.memory.cache_summary(session_id, summary, new_turn_time)
+                return summary
+            logger.info(f"会话摘要被其它worker先更新 重新合并:{session_id}")
+        raise RuntimeError(f"会话摘要并发冲突 重试{cas_retries}次仍失败")
+
+    def _loop(self):
+        while True:
+            session_id, generation, question, answer, turn_time = self._queue.get()
+            try:
+                if generation != self._generation(session_id):
+                    self.skipped += 1
+                    continue
+                if self.summarize(session_id, question, answer, turn_time, generation) is None:
+                    self.skipped += 1
+                else:
+                    self.updated += 1
+            except Exception as e:
+                # 失败时保留旧摘要 这一轮的ts比摘要新 仍会原样带上
+                self.failed += 1
+                logger.error(f"会话摘要更新失败:{session_id} {e}")
+            finally:
+                self._queue.task_done()
+
+    # 等待队列中的摘要全部完成
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "updated": self.updated, "failed": self.failed,
+                "skipped": self.skipped}
@@ -0,0 +1,146 @@
+from managers.mysql_manager import QuestionManager
+from datas import filepaths as fp
+from utils.general_utils.loggers import logger
+from utils.general_utils.snapshot_util import prune_snapshots, read_snapshot, snapshot_path, write_snapshot
+import numpy as np
+import threading
+import jieba
+import os
+
+# 无法判断学科的文档归到这个学科 路由时总会带上它
+DEFAULT_SUBJECT = "通用"
+# 查询的最高学科概率达到该值才路由 否则检索全部学科
+route_threshold = 0.6
+# 朴素贝叶斯平滑系数
+smoothing = 1.0
+# 分类器快照目录 每个jpkb校验和对应一个子目录 与BM25快照同样按校验和失效
+SNAPSHOT_DIR = os.path.join(fp.FILES_DIR, 'subject_router_snapshot')
+snapshot_version = 1
+
+
+class SubjectRouter:
+    """
+    轻量学科分类器: 用jpkb的 subject_name 与问答文本训练多项式朴素贝叶斯
+    入库时给文档打学科标签(作为milvus分区键), 检索时把查询路由到对应学科
+    """
+
+    def __init__(self, rows=None):
+        """
+        :param rows: [{'subject_name':..., 'question':..., 'answer':...}] 默认从jpkb读取
+                     默认时优先加载与jpkb校验和一致的快照, 避免每个worker启动都重新分词训练
+        """
+        self._lock = threading.Lock()
+        self.subjects = []
+        self.vocab = {}
+        self.log_prob = None
+        self.log_prior = None
+        if rows is not None:
+            self.fit(rows)
+        else:
+            self._init_from_snapshot()
+
+    def _init_from_snapshot(self):
+        checksum = QuestionManager.get_checksum()
+        path = snapshot_path(SNAPSHOT_DIR, checksum)
+        if checksum is not None and self.load(path):
+            logger.info(f"加载学科分类器快照:{path}")
+            prune_snapshots(SNAPSHOT_DIR, path)
+            return
+        self.fit(QuestionManager.get_subject_rows())
+        if checksum is not None:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            self.save(path)
+            # 只保留当前和上一个快照
+            prune_snapshots(SNAPSHOT_DIR, path)
+
+    def save(self, path):
+        """
+        保存为目录快照
+        :param path: 快照目录
+        :return: True 写入成功 / False 目录已被其他进程写入
+        """
+        with self._lock:
+            arrays = {"log_prob": self.log_prob, "log_prior": self.log_prior}
+            meta = {"subjects": self.subjects, "vocab": list(self.vocab)}
+        return write_snapshot(path, arrays, meta, snapshot_version)
+
+    def load(self, path):
+        """
+        以mmap方式加载快照, 多个进程共享同一份页缓存
+        :param path: 快照目录
+        :return: 是否加载成功 快照不存在或版本不符时返回False
+        """
+        snapshot = read_snapshot(path, ("log_prob", "log_prior"), snapshot_version)
+        if snapshot is None:
+            return False
+        meta, arrays = snapshot
+        with self._lock:
+            self.subjects = meta["subjects"]
+            self.vocab = {token: i for i, token in enumerate(meta["vocab"])}
+            self.log_prob = arrays["log_prob"]
+            self.log_prior = arrays["log_prior"]
+        logger.info(f"学科分类器: {len(self.subjects)}个学科, 词表{len(self.vocab)}")
+        return True
+
+    def fit(self, rows):
+        subjects = sorted({row['subject_name'] for row in rows if row.get('subject_name')})
+        subject_index = {subject: i for i, subject in enumerate(subjects)}
+        vocab = {}
+        counts_rows, counts_cols = [], []
+        doc_counts = np.zeros(len(subjects))
+        for row in rows:
+            if row.get('subject_name') not in subject_index:
+                continue
+            i = subject_index[row['subject_name']]
+            doc_counts[i] += 1
+            for token in self._tokens(f"{row['question']} {row.get('answer') or ''}"):
+                counts_rows.append(i)
+                counts_cols.append(vocab.setdefault(token, len(vocab)))
+        counts = np.zeros((len(subjects), len(vocab)))
+        np.add.at(counts, (counts_rows, counts_cols), 1)
+        counts += smoothing
+        with self._lock:
+            self.subjects = subjects
+            self.vocab = vocab
+            self.log_prob = np.log(counts / counts.sum(axis=1, keepdims=True))
+            self.log_prior = np.log(doc_counts / max(doc_counts.sum(), 1) + 1e-12)
+        logger.info(f"学科分类器: {len(subjects)}个学科, 词表{len(vocab)}")
+
+    @staticmethod
+    def _tokens(text):
+        return [token for token in jieba.lcut(text.lower()) if token.strip()]
+
+    def predict_proba(self, text):
+        """
+        :return: 按概率降序的 [(学科, 概率)] 文本里没有已知词时为空
+        """
+        with self._lock:
+            if not self.subjects:
+                return []
+            ids = [self.vocab[token] for token in self._tokens(text) if token in self.vocab]
+            if not ids:
+                return []
+            log_scores = self.log_prior + self.log_prob[:, ids].sum(axis=1)
+            subjects = self.subjects
+        probs = np.exp(log_scores - log_scores.max())
+        probs /= probs.sum()
+        order = np.argsort(-probs, kind="stable")
+        return [(subjects[i], float(probs[i])) for i in order]
+
+    # 文档的学科 取概率最高的学科
+    def classify(self, text):
+        proba = self.predict_proba(text)
+        return proba[0][0] if proba else DEFAULT_SUBJECT
+
+    def route(self, query, subject=None):
+        """
+        :param subject: 调用方显式指定的学科 优先于分类器
+        :return: 要检索的学科列表 None表示检索全部
+        """
+        if subject:
+            return [subject, DEFAULT_SUBJECT]
+        proba = self.predict_proba(query)
+        if proba and proba[0][1] >= route_threshold:
+            logger.info(f"学科路由:{query} -> {proba[0][0]} ({proba[0][1]:.2f})")
+            return [proba[0][0], DEFAULT_SUBJECT]
+        return None
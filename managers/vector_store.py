@@ -1,10 +1,35 @@
-from conn import rerank_conn,milvus_conn
+from conn import rerank_conn,milvus_conn,redis_conn,inference_backend
 from pymilvus import DataType,AnnSearchRequest, WeightedRanker
 from base import configs
-from milvus_model.hybrid import BGEM3EmbeddingFunction
 from datetime import datetime
 from tqdm import tqdm
 from utils.general_utils.globle_util import gen_hash
+from utils.general_utils.pipeline_util import batched, bounded_iter
+from managers.embedding_batcher import EmbeddingBatcher
+from managers.embedding_cache import EmbeddingCache
+from managers.retrieval_cache import RetrievalCache
+from managers.mysql_manager import ParentManager
+from managers import index_profiles
+from managers.subject_router import DEFAULT_SUBJECT
+import asyncio
+import json
+
+# 查询向量微批：单批最大条数与凑批最长等待（秒）
+embed_max_batch = 16
+embed_max_wait = 0.005
+# 查询向量缓存：进程内条数、过期时间（秒）、是否用redis做多worker共享的二级缓存
+embed_cache_size = 10000
+embed_cache_ttl = 3600
+embed_cache_redis = False
+# 检索结果缓存：进程内条数、过期时间（秒）、结果是否也放redis共享
+# 索引版本号只要redis可用就放在redis 离线入库后在线服务随即失效 与这个开关无关
+retrieval_cache_size = 10000
+retrieval_cache_ttl = 600
+retrieval_cache_redis = False
+# 入库流水线各阶段之间的队列长度（批）
+ingest_queue_size = 4
+# 学科字段作为分区键 milvus按哈希把学科分到这么多个分区
+subject_partitions = 16
 # 定义 VectorStore 类，封装向量存储和检索功能
 class VectorStore:
     # 初始化方法，设置向量存储的基本参数
@@ -12,13 +37,28 @@ class VectorStore:
         # 设置 Milvus 集合名称
         self.collection_name = "vector_store"
         self.rerank_model = rerank_conn.RerankModel()
-        # 初始化 BGE-M3 嵌入函数，使用 CPU 设备，不启用 FP16
-        self.embedding_function = BGEM3EmbeddingFunction()
+        # 初始化 BGE-M3 嵌入函数，按配置使用PyTorch或ONNX Runtime后端
+        self.embedding_function = inference_backend.get_embedding_function()
         # 获取稠密向量的维度
         self.dense_dim = self.embedding_function.dim["dense"]
         # print("稠密向量的维度:", self.dense_dim)
         # 初始化 Milvus 客户端，连接到指定主机和数据库
         self.client = milvus_conn.MilvusConn().client
+        # 异步客户端 给ahybrid_search用
+        self.async_conn = milvus_conn.AsyncMilvusConn()
+        # 查询嵌入统一走微批线程 CPU密集计算不占用事件循环和默认线程池
+        self.embed_batcher = EmbeddingBatcher(self.embedding_function, embed_max_batch, embed_max_wait)
+        # 热门问题的向量直接命中缓存 不再过模型
+        self.embed_cache = EmbeddingCache(embed_cache_size, embed_cache_ttl,
+                                          redis_conn.RedisClient() if embed_cache_redis else None)
+        # 重复查询直接返回上次的检索结果 不再访问milvus
+        self.retrieval_cache = RetrievalCache(retrieval_cache_size, retrieval_cache_ttl,
+                                              redis_conn.RedisClient(), share_results=retrieval_cache_redis)
+        # 其它进程改了集合(及父文档表) 本进程的父文档缓存也跟着清空
+        self.retrieval_cache.add_listener(ParentManager.clear_cache)
+        # 索引配置档 检索参数可在运行时调整(调参脚本会逐组覆盖)
+        self.profile = index_profiles.get_profile()
+        self.dense_search_params = dict(self.profile["dense_search"])
         # 调用方法创建或加载 Milvus 集合
         self._create_or_load_collection()
 
@@ -38,72 +78,144 @@ class VectorStore:
             schema.add_field(field_name="sparse_vector", datatype=DataType.SPARSE_FLOAT_VECTOR)
             # 添加父块 ID 字段，VARCHAR 类型，最大长度 100
             schema.add_field(field_name="parent_id", datatype=DataType.VARCHAR, max_length=32)
-            # 添加父块内容字段，VARCHAR 类型，最大长度 65535
-            schema.add_field(field_name="parent_content", datatype=DataType.VARCHAR, max_length=65535)
+            # 父块内容只在mysql的parent_doc表中存一份，这里不再冗余存储
             # 添加学科类别字段，VARCHAR 类型，最大长度 50
             schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=256)
+            # 学科字段作为分区键 按学科过滤时只扫描对应分区
+            schema.add_field(field_name="subject", datatype=DataType.VARCHAR, max_length=64, is_partition_key=True)
             # 添加时间戳字段，VARCHAR 类型，最大长度 50
             schema.add_field(field_name="timestamp", datatype=DataType.FLOAT)
 
-            # 创建索引参数对象
-            index_params = self.client.prepare_index_params()
-            # 为稠密向量字段添加 IVF_FLAT 索引，度量类型为内积 (IP)
-            index_params.add_index(
-                field_name="dense_vector",
-                index_name="dense_index",
-                index_type="IVF_FLAT",
-                metric_type="COSINE",
-                params={"nlist": 128}
-            )
-            # 为稀疏向量字段添加 SPARSE_INVERTED_INDEX 索引，度量类型为内积 (IP)
-            index_params.add_index(
-                field_name="sparse_vector",
-                index_name="sparse_index",
-                index_type="SPARSE_INVERTED_INDEX",
-                metric_type="IP",
-                params={"drop_ratio_build": 0.2}
-            )
+            # 按配置档创建索引参数
+            index_params = self._index_params()
 
             # 创建 Milvus 集合，应用定义的 Schema 和索引参数
             self.client.create_collection(collection_name=self.collection_name, schema=schema,
-                                         index_params=index_params)
+                                         index_params=index_params, num_partitions=subject_partitions)
+        else:
+            self._check_schema()
         # 将集合加载到内存，确保可立即查询
         self.client.load_collection(self.collection_name)
 
+    # 已存在的集合必须是当前的schema 旧集合在这里直接报错 而不是在插入或检索时才失败
+    def _check_schema(self):
+        fields = {field["name"]: field for field in self.client.describe_collection(self.collection_name)["fields"]}
+        problems = []
+        if "parent_content" in fields:
+            # 旧schema里parent_content是必填字段 新数据不再写入, 检索也只从parent_doc表取父文档
+            problems.append("仍包含parent_content字段(父文档已移到mysql的parent_doc表)")
+        if not fields.get("subject", {}).get("is_partition_key"):
+            # 没有学科分区键时 按学科路由的过滤表达式会报错或退化为全量扫描
+            problems.append("缺少作为分区键的subject字段")
+        if problems:
+            raise RuntimeError(f"milvus集合{self.collection_name}是旧版schema: {'; '.join(problems)}。"
+                               f"请删除该集合后重新运行离线入库 offline/insert2milvus 重建")
+
+    def _index_params(self):
+        profile = self.profile
+        index_params = self.client.prepare_index_params()
+        # 稠密向量索引 类型和参数由配置档决定 度量统一为余弦
+        index_params.add_index(
+            field_name="dense_vector",
+            index_name="dense_index",
+            index_type=profile["dense_index"]["index_type"],
+            metric_type="COSINE",
+            params=profile["dense_index"]["params"]
+        )
+        # 稀疏向量使用倒排索引，度量类型为内积 (IP)
+        index_params.add_index(
+            field_name="sparse_vector",
+            index_name="sparse_index",
+            index_type=profile["sparse_index"]["index_type"],
+            metric_type="IP",
+            params=profile["sparse_index"]["params"]
+        )
+        return index_params
+
+    # 切换索引配置档 对已有集合重建两个向量索引 期间集合不可检索
+    def rebuild_index(self,profile_name=None):
+        self.profile = index_profiles.get_profile(profile_name)
+        self.dense_search_params = dict(self.profile["dense_search"])
+        self.client.release_collection(self.collection_name)
+        for index_name in ("dense_index", "sparse_index"):
+            self.client.drop_index(collection_name=self.collection_name, index_name=index_name)
+        self.client.create_index(collection_name=self.collection_name, index_params=self._index_params())
+        self.client.load_collection(self.collection_name)
+        self.retrieval_cache.bump_version()
+
     #整理稀疏向量
     def _prepare_sparse_vector(self, row):
         return {index: data for index, data in zip(row.indices,row.data)}
 
-    #添加chunk
-    def add_chunks(self,chunks):
-        embeddings = self.emb_model.encode_documents([chunk["text"] for chunk in chunks])
+    # chunk在milvus中的主键 由切块时按父块id派生 旧数据没有id时退回文本hash
+    @staticmethod
+    def chunk_id(chunk):
+        return chunk.get("id") or gen_hash(chunk["text"])
+
+    # 对一批chunk做嵌入并整理成milvus的行
+    def _embed_batch(self,batch_chunks):
+        embeddings = self.embedding_function.encode_documents([chunk["text"] for chunk in batch_chunks])
         datas = []
-        total_batchs = (len(chunks) + configs.batch_size - 1) // configs.batch_size
-        for i in tqdm(range(0, len(chunks), configs.batch_size), desc="插入批次"):
-            batch_chunks = chunks[i:i + configs.batch_size]
-            batch_dense = embeddings["dense"][i:i + configs.batch_size]
-            batch_sparse = embeddings["sparse"][i:i + configs.batch_size]
-            datas = []
-            for chunk, dense, sparse in zip(batch_chunks, batch_dense, batch_sparse):
-                d = {
-                    "id": gen_hash(chunk["text"]),
-                    "text": chunk["text"],
-                    "dense_vector": dense,
-                    "sparse_vector": self._prepare_sparse_vector(sparse),
-                    "source": chunk["source"],
-                    "parent_id": chunk["parent_id"],
-                    "parent_content": chunk["parent_content"],
-                    "timestamp": datetime.now().timestamp()  # 时间戳
-                }
-                datas.append(d)
-        self.client.upsert(collection_name=self.collection_name, data=datas)
-
-
-    def hybrid_search(self,query,c=configs.c):
-        # c:召回出来的候选数量:
-        # k:最终精排后的top k
-        # 使用 BGE-M3 嵌入函数生成查询的嵌入
-        query_embeddings = self.embedding_function([query])
+        parents = {}
+        for i, chunk in enumerate(batch_chunks):
+            parents[chunk["parent_id"]] = {"id": chunk["parent_id"], "content": chunk["parent_content"],
+                                           "source": chunk["source"]}
+            d = {
+                "id": self.chunk_id(chunk),
+                "text": chunk["text"],
+                "dense_vector": embeddings["dense"][i],
+                "sparse_vector": self._prepare_sparse_vector(embeddings["sparse"]._getrow(i)),
+                "source": chunk["source"],
+                "subject": chunk.get("subject") or DEFAULT_SUBJECT,
+                "parent_id": chunk["parent_id"],
+                "timestamp": datetime.now().timestamp()  # 时间戳
+            }
+            datas.append(d)
+        return datas, list(parents.values())
+
+    #添加chunk
+    def add_chunks(self,chunks,batch_size=configs.batch_size):
+        """
+        流式入库: 切块 -> 批量嵌入 -> upsert 三个阶段各占一个线程, 之间用定长队列衔接,
+        内存里最多只有几批数据, 与语料总量无关
+        :param chunks: chunk的可迭代对象(列表或生成器)
+        :param batch_size: 每批条数
+        :return: 写入的条数
+        """
+        batches = bounded_iter(batched(chunks, batch_size), ingest_queue_size)
+        embedded = bounded_iter((self._embed_batch(batch) for batch in batches), ingest_queue_size)
+        total = 0
+        written_parents = set()
+        for datas, parents in tqdm(embedded, desc="插入批次"):
+            # 先写父文档 保证检索到子块时父文档已存在
+            parents = [p for p in parents if p["id"] not in written_parents]
+            ParentManager.upsert_parents(parents)
+            written_parents.update(p["id"] for p in parents)
+            self.client.upsert(collection_name=self.collection_name, data=datas)
+            total += len(datas)
+        if total:
+            # 集合内容变了 缓存的检索结果作废
+            self.retrieval_cache.bump_version()
+        return total
+
+    # 按主键批量删除chunk
+    def delete_chunks(self,ids,batch_size=1000):
+        ids = list(ids)
+        for i in range(0, len(ids), batch_size):
+            self.client.delete(collection_name=self.collection_name, ids=ids[i:i + batch_size])
+        if ids:
+            self.retrieval_cache.bump_version()
+        return len(ids)
+
+    # 学科过滤表达式 subjects为None时不过滤
+    @staticmethod
+    def subject_filter(subjects):
+        if not subjects:
+            return ""
+        return f"subject in {json.dumps(list(subjects), ensure_ascii=False)}"
+
+    # 构建稠密+稀疏两路搜索请求
+    def _build_search_requests(self,query_embeddings,c,subjects=None):
         # 获取查询的稠密向量
         dense_query_vector = query_embeddings["dense"][0]
         # 初始化查询的稀疏向量
@@ -113,39 +225,138 @@ class VectorStore:
         dense_request = AnnSearchRequest(
             data=[dense_query_vector],
             anns_field="dense_vector",
-            param={"metric_type": "COSINE", "params": {"nprobe": 10}},
-            limit=c
+            param={"metric_type": "COSINE", "params": self.dense_search_params},
+            limit=c,
+            expr=self.subject_filter(subjects)
         )
         # 创建稀疏向量搜索请求
         sparse_request = AnnSearchRequest(
             data=[sparse_query_vector],
             anns_field="sparse_vector",
-            param={"metric_type": "IP", "params": {"nprobe": 5}},
-            limit=c
+            param={"metric_type": "IP", "params": self.profile["sparse_search"]},
+            limit=c,
+            expr=self.subject_filter(subjects)
         )
+        return [dense_request, sparse_request]
 
+    # 从子块中提取去重的 (父文档id, 混合得分) hits为单个query的命中列表
+    def _extract_parent_hits(self,hits):
+        # 命中按得分降序 同一父文档保留第一次(最高分)出现
+        parents = {}
+        for hit in hits:
+            parents.setdefault(hit["entity"]["parent_id"], hit["distance"])
+        return list(parents.items())
+
+    # 生成查询的稠密+稀疏向量 并发请求会被合并成一批
+    def embed_query(self,query):
+        query_embeddings = self.embed_cache.get(query)
+        if query_embeddings is None:
+            query_embeddings = self.embed_batcher.embed(query)
+            self.embed_cache.set(query,query_embeddings)
+        return query_embeddings
+
+    async def aembed_query(self,query):
+        # 带redis时查缓存有网络往返 放到线程里
+        if self.embed_cache.redis is None:
+            query_embeddings = self.embed_cache.get(query)
+        else:
+            query_embeddings = await asyncio.to_thread(self.embed_cache.get,query)
+        if query_embeddings is None:
+            query_embeddings = await self.embed_batcher.aembed(query)
+            if self.embed_cache.redis is None:
+                self.embed_cache.set(query,query_embeddings)
+            else:
+                await asyncio.to_thread(self.embed_cache.set,query,query_embeddings)
+        return query_embeddings
+
+    # 影响混合检索结果的参数 作为检索结果缓存key的一部分
+    def _retrieval_params(self,c,subjects):
+        return {"c": c, "k": configs.k, "subjects": sorted(subjects) if subjects else None,
+                "weights": [configs.SPARSE_WEIGHT, configs.DENSE_WEIGHT],
+                "dense": self.dense_search_params, "sparse": self.profile["sparse_search"]}
+
+    # 混合检索 返回去重后的 (父文档id, WeightedRanker得分)
+    def hybrid_search_hits(self,query,c=configs.c,subjects=None):
+        # subjects: 只检索这些学科(分区) None为全部
+        params = self._retrieval_params(c,subjects)
+        hits = self.retrieval_cache.get(query,params)
+        if hits is None:
+            hits = self._hybrid_search_hits(query,c,subjects)
+            self.retrieval_cache.set(query,params,hits)
+        return hits
+
+    def _hybrid_search_hits(self,query,c,subjects):
+        # c:召回出来的候选数量:
+        # k:最终精排后的top k
+        # 使用 BGE-M3 嵌入函数生成查询的嵌入
+        query_embeddings = self.embed_query(query)
         # 创建加权排序器，稀疏向量权重 0.7，稠密向量权重 1.0
         ranker = WeightedRanker(configs.SPARSE_WEIGHT, configs.DENSE_WEIGHT)
         # 执行混合搜索，返回 k结果
         results = self.client.hybrid_search(
             collection_name=self.collection_name,# 集合名称
-            reqs=[dense_request, sparse_request],# 混合搜索请求
+            reqs=self._build_search_requests(query_embeddings,c,subjects),# 混合搜索请求
             ranker=ranker,# 加权排序实例
             limit=configs.k,# 返回的Top-K
-            output_fields=["parent_content"]# 在返回字段里添加parent_content关联父文档内容
+            output_fields=["parent_id"]# 只取parent_id 父文档内容批量从父文档表取
         )
-        # 从子块中提取去重的父文档
-        # 先用set去重 然后回复成列表
-        results = list(set([result["parent_content"] for result in results]))
-        return results
+        return self._extract_parent_hits(results[0])
+
+    # 混合检索 返回去重后的父文档id
+    def hybrid_search_ids(self,query,c=configs.c,subjects=None):
+        return [parent_id for parent_id, _ in self.hybrid_search_hits(query,c,subjects)]
+
+    def hybrid_search(self,query,c=configs.c,subjects=None):
+        return ParentManager.get_parents(self.hybrid_search_ids(query,c,subjects))
+
+    # 异步混合检索：嵌入交给微批线程，milvus用异步客户端
+    async def ahybrid_search_hits(self,query,c=configs.c,subjects=None):
+        params = self._retrieval_params(c,subjects)
+        # 结果放在redis时查缓存有网络往返 放到线程里
+        if not self.retrieval_cache.share_results:
+            hits = self.retrieval_cache.get(query,params)
+        else:
+            hits = await asyncio.to_thread(self.retrieval_cache.get,query,params)
+        if hits is not None:
+            return hits
+        hits = await self._ahybrid_search_hits(query,c,subjects)
+        if not self.retrieval_cache.share_results:
+            self.retrieval_cache.set(query,params,hits)
+        else:
+            await asyncio.to_thread(self.retrieval_cache.set,query,params,hits)
+        return hits
+
+    async def _ahybrid_search_hits(self,query,c,subjects):
+        query_embeddings = await self.aembed_query(query)
+        ranker = WeightedRanker(configs.SPARSE_WEIGHT, configs.DENSE_WEIGHT)
+        results = await self.async_conn.client.hybrid_search(
+            collection_name=self.collection_name,
+            reqs=self._build_search_requests(query_embeddings,c,subjects),
+            ranker=ranker,
+            limit=configs.k,
+            output_fields=["parent_id"]
+        )
+        return self._extract_parent_hits(results[0])
+
+    async def ahybrid_search_ids(self,query,c=configs.c,subjects=None):
+        return [parent_id for parent_id, _ in await self.ahybrid_search_hits(query,c,subjects)]
+
+    async def ahybrid_search(self,query,c=configs.c,subjects=None):
+        return await ParentManager.aget_parents(await self.ahybrid_search_ids(query,c,subjects))
 
-    def rerank(self,query,results,m=configs.CANDIDATE_M):
-        return self.rerank_model.rerank(query,results)[:m]
+    def rerank(self,query,results,m=configs.CANDIDATE_M,doc_ids=None):
+        """
+        :param results: 父文档内容列表
+        :param doc_ids: 对应的父文档id 用于重排序得分缓存
+        """
+        return self.rerank_model.rerank(query,results,doc_ids)[:m]
 
     # 定义方法，执行混合检索并重排序
-    def hybrid_search_with_rerank(self, query, k=configs.RETRIEVAL_K, m =configs.CANDIDATE_M):
-        results = self.hybrid_search(query, k)
-        return self.rerank(query, results, m)
+    def hybrid_search_with_rerank(self, query, k=configs.RETRIEVAL_K, m =configs.CANDIDATE_M, subjects=None):
+        parent_ids = self.hybrid_search_ids(query, k, subjects)
+        parents = ParentManager.get_parent_map(parent_ids)
+        parent_ids = [i for i in parent_ids if i in parents]
+        return self.rerank(query, [parents[i] for i in parent_ids], m, parent_ids)
 
 if __name__ == '__main__':
     vs = VectorStore()
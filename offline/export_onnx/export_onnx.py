@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import torch
+from conn import inference_backend as ib
+from utils.general_utils.loggers import logger
+
+# 导出用的opset与样例长度
+opset = 17
+# 一致性检查用的样例
+PARITY_QUERIES = ["什么是RAG", "如何使用Langchain", "为什么第三天和第九天生成jwt的方式不一样"]
+PARITY_DOCS = [
+    "RAG(检索增强生成)先从知识库检索相关文档，再把文档作为上下文交给大模型生成答案。",
+    "LangChain是一个用于构建大模型应用的框架，提供了Prompt、Chain、Agent等组件。",
+    "JWT由header、payload和signature三部分组成，不同课程中使用了不同的签名库。",
+    "今天天气不错，适合出去散步。",
+]
+
+
+# BGE-M3的导出包装: 输出 归一化CLS稠密向量 与 每个token的稀疏权重
+class _BGEM3Wrapper(torch.nn.Module):
+    def __init__(self, model, sparse_linear):
+        super().__init__()
+        self.model = model
+        self.sparse_linear = sparse_linear
+
+    def forward(self, input_ids, attention_mask):
+        hidden = self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        dense = torch.nn.functional.normalize(hidden[:, 0], dim=-1)
+        token_weights = torch.relu(self.sparse_linear(hidden))
+        return dense, token_weights
+
+
+def _export(module, inputs, output_names, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dynamic_axes = {name: {0: "batch", 1: "seq"} for name in inputs}
+    dynamic_axes.update({name: {0: "batch"} for name in output_names})
+    torch.onnx.export(module, tuple(inputs.values()), path, input_names=list(inputs),
+                      output_names=output_names, dynamic_axes=dynamic_axes, opset_version=opset)
+    logger.info(f"已导出:{path}")
+
+
+def export_reranker():
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    tokenizer = AutoTokenizer.from_pretrained(ib.RERANKER_DIR)
+    model = AutoModelForSequenceClassification.from_pretrained(ib.RERANKER_DIR).eval()
+    inputs = tokenizer(["样例"], ["样例文档"], return_tensors="pt")
+    inputs = {k: inputs[k] for k in ("input_ids", "attention_mask")}
+    _export(model, inputs, ["logits"], ib.onnx_model_path('bge-reranker-base'))
+
+
+def export_bge_m3():
+    from transformers import AutoTokenizer, AutoModel
+    tokenizer = AutoTokenizer.from_pretrained(ib.BGE_M3_DIR)
+    model = AutoModel.from_pretrained(ib.BGE_M3_DIR).eval()
+    # sparse_linear 权重随模型一起发布在 sparse_linear.pt
+    sparse_linear = torch.nn.Linear(model.config.hidden_size, 1)
+    sparse_linear.load_state_dict(torch.load(os.path.join(ib.BGE_M3_DIR, 'sparse_linear.pt'), map_location="cpu"))
+    inputs = tokenizer(["样例文档"], return_tensors="pt")
+    inputs = {k: inputs[k] for k in ("input_ids", "attention_mask")}
+    _export(_BGEM3Wrapper(model, sparse_linear).eval(), inputs, ["dense", "token_weights"],
+            ib.onnx_model_path('bge-m3'))
+
+
+# 动态int8量化 只量化权重 不需要校准数据
+def quantize(name):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(ib.onnx_model_path(name), ib.onnx_model_path(name, quantized=True),
+                     weight_type=QuantType.QInt8)
+    logger.info(f"已量化:{ib.onnx_model_path(name, quantized=True)}")
+
+
+def parity_reranker(name):
+    """
+    对比torch与onnx后端的重排序得分
+    :return: {"max_abs_diff":..., "mean_abs_diff":..., "top1_agree":...}
+    """
+    ref = ib.get_cross_encoder("cpu", 512, "torch")
+    other = ib.get_cross_encoder("cpu", 512, name)
+    pairs = [[q, d] for q in PARITY_QUERIES for d in PARITY_DOCS]
+    a = np.asarray(ref.predict(pairs), dtype=np.float32).reshape(len(PARITY_QUERIES), -1)
+    b = np.asarray(other.predict(pairs), dtype=np.float32).reshape(len(PARITY_QUERIES), -1)
+    diff = np.abs(a - b)
+    return {"max_abs_diff": float(diff.max()), "mean_abs_diff": float(diff.mean()),
+            "top1_agree": float((a.argmax(1) == b.argmax(1)).mean())}
+
+
+def parity_bge_m3(name):
+    """
+    对比torch与onnx后端的BGE-M3向量
+    :return: 稠密向量余弦相似度的最小值, 稀疏向量与文档内积的最大偏差
+    """
+    ref = ib.get_embedding_function("torch")
+    other = ib.get_embedding_function(name)
+    texts = PARITY_QUERIES + PARITY_DOCS
+    a, b = ref(texts), other(texts)
+    da, db = np.stack(a["dense"]), np.stack(b["dense"])
+    cos = (da * db).sum(1) / (np.linalg.norm(da, axis=1) * np.linalg.norm(db, axis=1))
+    n = len(PARITY_QUERIES)
+    sa = (a["sparse"][:n] @ a["sparse"][n:].T).toarray()
+    sb = (b["sparse"][:n] @ b["sparse"][n:].T).toarray()
+    return {"min_dense_cos": float(cos.min()), "max_sparse_score_diff": float(np.abs(sa - sb).max())}
+
+
+if __name__ == '__main__':
+    export_reranker()
+    export_bge_m3()
+    for model_name in ('bge-reranker-base', 'bge-m3'):
+        quantize(model_name)
+    for backend_name in ("onnx", "onnx-int8"):
+        logger.info(f"{backend_name} 重排序得分偏差:{parity_reranker(backend_name)}")
+        logger.info(f"{backend_name} BGE-M3偏差:{parity_bge_m3(backend_name)}")
@@ -1,6 +1,8 @@
 from utils.doc_utils.doc_reader_utils import DOC_READERS
 from utils.doc_utils.text_splitters_utils import get_text_splitter
 from base import configs as cfg
+from utils.general_utils.pipeline_util import ordered_process_map
+from utils.general_utils.globle_util import gen_parent_id, gen_child_id
 import os
 
 class DocumentLoader:
@@ -21,23 +23,53 @@ class DocumentLoader:
         text = DOC_READERS[file_extension](file_path)
         docs = self.parent_text_splitter.split_text(text)
 
-        for i, doc in enumerate(docs):
+        for doc in docs:
+            # 父块id按文件+内容寻址 子块id由父块id派生 重复入库时id稳定不变
+            parent_id = gen_parent_id(file_name, doc)
             child_docs = self.child_text_splitter.split_text(doc)
             for j, child_doc in enumerate(child_docs):
                 yield {
+                    "id": gen_child_id(parent_id, j),
                     "text": child_doc,
                     "source": file_name,
-                    "parent_id": f'parent_{i}',
+                    "parent_id": parent_id,
                     "parent_content": doc
                 }
-    def load_directory(self, directory_path):
-        chunks = []
-        for file_name in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, file_name)
-            if os.path.isfile(file_path):
-                for chunk in self.load_one_file(file_path):
-                    chunks.append(chunk)
-        return chunks
+    # 列出目录下的文件 按文件名排序
+    @staticmethod
+    def list_files(directory_path):
+        file_paths = [os.path.join(directory_path, file_name) for file_name in sorted(os.listdir(directory_path))]
+        return [file_path for file_path in file_paths if os.path.isfile(file_path)]
+
+    # 按文件产出 (文件路径, chunk列表)
+    def iter_file_chunks(self, file_paths, workers=1):
+        """
+        :param file_paths: 文件路径列表
+        :param workers: 解析进程数 大于1时多进程解析切分, 结果仍按输入顺序返回
+        """
+        if workers <= 1:
+            for file_path in file_paths:
+                yield file_path, list(self.load_one_file(file_path))
+            return
+        results = ordered_process_map(_load_file_chunks, file_paths, workers, initializer=_init_worker)
+        for file_path, chunks in zip(file_paths, results):
+            yield file_path, chunks
+
+    # 逐个文件产出chunk 不在内存中积累整个目录
+    def iter_directory(self, directory_path, workers=1):
+        for _, chunks in self.iter_file_chunks(self.list_files(directory_path), workers):
+            yield from chunks
+    def load_directory(self, directory_path, workers=1):
+        return list(self.iter_directory(directory_path, workers))
+
+
+# 子进程里各自持有一个DocumentLoader
+_worker_loader = None
+def _init_worker():
+    global _worker_loader
+    _worker_loader = DocumentLoader()
+def _load_file_chunks(file_path):
+    return list(_worker_loader.load_one_file(file_path))
 if __name__ == '__main__':
     from datas.filepaths import PDFS_DIR
     loader = DocumentLoader()
@@ -1,11 +1,74 @@
 from managers import vector_store
 from offline.insert2milvus import doc_process
-from datas.filepaths import PDFS_DIR
+from offline.insert2milvus.manifest import IndexManifest
+from managers.mysql_manager import ParentManager
+from managers.subject_router import SubjectRouter
+from datas.filepaths import PDFS_DIR, FILES_DIR
+from utils.general_utils.loggers import logger
+import os
+
+# 文档解析进程数
+parse_workers = 4
+# 入库清单
+MANIFEST_PATH = os.path.join(FILES_DIR, 'milvus_manifest.json')
+
+# 按整篇文档的内容判断学科 同一文件的chunk写进同一个分区
+def with_subject(file_chunks, router):
+    for file_path, chunks in file_chunks:
+        subject = router.classify(' '.join(chunk["text"] for chunk in chunks))
+        logger.info(f"{os.path.basename(file_path)} 学科:{subject}")
+        for chunk in chunks:
+            chunk["subject"] = subject
+        yield file_path, chunks
 
 def insert_data():
+    ParentManager.create_table()
     vs = vector_store.VectorStore()
     loader = doc_process.DocumentLoader()
-    chunks = loader.load_directory(PDFS_DIR)
-    vs.add_chunks(chunks)
+    file_chunks = with_subject(loader.iter_file_chunks(loader.list_files(PDFS_DIR), parse_workers), SubjectRouter())
+    # 生成器直接喂给入库流水线
+    vs.add_chunks(chunk for _, chunks in file_chunks for chunk in chunks)
+
+# 增量同步：只处理新增/修改的文件，并删除修改或删除文件留下的旧chunk
+def sync_data(directory_path=PDFS_DIR, manifest_path=MANIFEST_PATH):
+    manifest = IndexManifest(manifest_path)
+    loader = doc_process.DocumentLoader()
+    changed, removed = manifest.diff(loader.list_files(directory_path))
+    logger.info(f"增量同步: 变更文件{len(changed)}个, 删除文件{len(removed)}个")
+    if not changed and not removed:
+        manifest.save()
+        return
+    ParentManager.create_table()
+    vs = vector_store.VectorStore()
+
+    old_ids = set()
+    for file_path in removed:
+        old_ids |= manifest.chunk_ids(file_path)
+        manifest.remove(file_path)
+    new_ids = {}
+    new_parent_ids = {}
+    # 入库的同时记下每个文件产生的chunk id与父文档id
+    router = SubjectRouter()
+    def chunks_with_ids():
+        for file_path, chunks in with_subject(loader.iter_file_chunks(changed, parse_workers), router):
+            new_ids[file_path] = [vs.chunk_id(chunk) for chunk in chunks]
+            new_parent_ids[file_path] = {chunk["parent_id"] for chunk in chunks}
+            yield from chunks
+    vs.add_chunks(chunks_with_ids())
+
+    for file_path in changed:
+        old_ids |= manifest.chunk_ids(file_path)
+        manifest.update(file_path, new_ids.get(file_path, []))
+    # 先写入新数据再删旧的 仍被其他文件引用的chunk保留
+    for file_path in changed + removed:
+        ParentManager.delete_stale(os.path.basename(file_path), new_parent_ids.get(file_path, []))
+    stale_ids = old_ids - manifest.referenced_ids()
+    vs.delete_chunks(stale_ids)
+    # 父文档表也变了 即使没有过期chunk也递增版本号 让在线服务清空检索与父文档缓存
+    if not stale_ids:
+        vs.retrieval_cache.bump_version()
+    logger.info(f"增量同步完成: 删除过期chunk{len(stale_ids)}个")
+    manifest.save()
+
 if __name__ == '__main__':
-    insert_data()
+    sync_data()
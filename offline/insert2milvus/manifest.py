@@ -0,0 +1,75 @@
+import json
+import os
+from utils.general_utils.globle_util import gen_file_hash
+
+manifest_version = 1
+
+
+class IndexManifest:
+    """
+    入库清单：记录每个文件的 大小/修改时间/内容hash 以及它产生的chunk id
+    大小和修改时间都没变的文件直接跳过, 变了再算内容hash, hash也没变只更新元信息
+    """
+
+    def __init__(self, path):
+        """
+        :param path: 清单json文件路径
+        """
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == manifest_version:
+                self.files = data['files']
+
+    def diff(self, file_paths):
+        """
+        :param file_paths: 当前目录下的所有文件
+        :return: (需要重新处理的文件列表, 已被删除的文件列表)
+        """
+        changed = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            entry = self.files.get(file_path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            file_hash = gen_file_hash(file_path)
+            if entry and entry['hash'] == file_hash:
+                entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+                continue
+            changed.append(file_path)
+        current = set(file_paths)
+        removed = [file_path for file_path in self.files if file_path not in current]
+        return changed, removed
+
+    def update(self, file_path, chunk_ids):
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': gen_file_hash(file_path),
+            'chunk_ids': list(dict.fromkeys(chunk_ids))
+        }
+
+    def remove(self, file_path):
+        return self.files.pop(file_path, None)
+
+    def chunk_ids(self, file_path):
+        entry = self.files.get(file_path)
+        return set(entry['chunk_ids']) if entry else set()
+
+    # 所有文件仍在引用的chunk id 不同文件可能产出相同内容的chunk
+    def referenced_ids(self):
+        ids = set()
+        for entry in self.files.values():
+            ids.update(entry['chunk_ids'])
+        return ids
+
+    # 先写临时文件再替换 中途失败不会损坏旧清单
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': manifest_version, 'files': self.files}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from uuid import uuid4
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# OpenAI兼容的假LLM服务 可配置首token延迟、chunk间隔与错误率 用来本地测试LLM路由
+ttft = 0.5
+chunk_delay = 0.05
+error_rate = 0.0
+reply = "LL为您服务，这是本地stub服务的回答。"
+
+app = FastAPI()
+
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: list
+    stream: bool = False
+
+
+def _chunk(completion_id, model, delta, finish_reason=None):
+    return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatRequest):
+    if random.random() < error_rate:
+        raise HTTPException(status_code=503, detail="stub error")
+    completion_id = f"chatcmpl-{uuid4().hex}"
+    if not request.stream:
+        await asyncio.sleep(ttft + chunk_delay * len(reply))
+        return {"id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": request.model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(reply), "total_tokens": len(reply)}}
+
+    async def events():
+        await asyncio.sleep(ttft)
+        yield f"data: {json.dumps(_chunk(completion_id, request.model, {'role': 'assistant', 'content': ''}))}\n\n"
+        for char in reply:
+            yield f"data: {json.dumps(_chunk(completion_id, request.model, {'content': char}), ensure_ascii=False)}\n\n"
+            await asyncio.sleep(chunk_delay)
+        yield f"data: {json.dumps(_chunk(completion_id, request.model, {}, 'stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="OpenAI兼容的stub LLM服务")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=ttft)
+    parser.add_argument("--chunk-delay", type=float, default=chunk_delay)
+    parser.add_argument("--error-rate", type=float, default=error_rate)
+    args = parser.parse_args()
+    ttft, chunk_delay, error_rate = args.ttft, args.chunk_delay, args.error_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
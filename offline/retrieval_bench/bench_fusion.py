@@ -0,0 +1,44 @@
+from base import configs
+from managers.vector_store import VectorStore
+from managers.client_fusion import FusionRetriever
+from managers import client_fusion
+from offline.retrieval_bench.bench_util import load_queries, timed, latency_stats, recall_at_k
+from utils.general_utils.loggers import logger
+
+
+def bench(queries, k=configs.k, methods=("rrf", "weighted", "normalized")):
+    """
+    对比服务端hybrid_search与客户端融合的延迟和recall@k
+    有标注时以标注为准 否则以服务端hybrid的top-k为参考
+    :return: {"server": {...}, "rrf": {...}, ...}
+    """
+    vector_store = VectorStore()
+    fusion = FusionRetriever(vector_store)
+    # 先预热 同时把查询向量放进缓存 两种方式只比较检索本身
+    for q in queries:
+        vector_store.embed_query(q["query"])
+
+    server_hits, server_lat = [], []
+    for q in queries:
+        hits, ms = timed(vector_store.hybrid_search_hits, q["query"])
+        server_hits.append([pid for pid, _ in hits])
+        server_lat.append(ms)
+    report = {"server": latency_stats(server_lat)}
+
+    for method in methods:
+        client_fusion.fusion_method = method
+        recalls, lat = [], []
+        for q, reference in zip(queries, server_hits):
+            hits, ms = timed(fusion.search_hits, q["query"], k=k)
+            recalls.append(recall_at_k([pid for pid, _ in hits], q["relevant"] or reference[:k], k))
+            lat.append(ms)
+        report[method] = dict(latency_stats(lat), recall=sum(recalls) / max(len(recalls), 1))
+    if any(q["relevant"] for q in queries):
+        report["server"]["recall"] = sum(recall_at_k(h, q["relevant"] or h[:k], k)
+                                         for q, h in zip(queries, server_hits)) / max(len(queries), 1)
+    return report
+
+
+if __name__ == '__main__':
+    for name, stats in bench(load_queries()).items():
+        logger.info(f"{name}: " + " ".join(f"{key}={value:.3f}" for key, value in stats.items()))
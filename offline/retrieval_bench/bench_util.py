@@ -0,0 +1,49 @@
+import json
+import os
+import random
+import time
+import numpy as np
+from datas import filepaths as fp
+from managers.mysql_manager import QuestionManager
+
+# 留出查询文件 每行 {"query": ..., "relevant": [parent_id, ...]}  relevant 可省略
+QUERIES_PATH = os.path.join(fp.FILES_DIR, 'retrieval_queries.jsonl')
+# 没有查询文件时从FAQ问题里抽样的数量
+sample_size = 200
+
+
+def load_queries(path=QUERIES_PATH, n=sample_size, seed=0):
+    """
+    :return: [{"query": ..., "relevant": [...] 或 None}]
+    """
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [{"query": r["query"], "relevant": r.get("relevant")} for r in rows]
+    questions = QuestionManager.get_all_questions()
+    random.Random(seed).shuffle(questions)
+    return [{"query": q, "relevant": None} for q in questions[:n]]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_stats(latencies_ms):
+    arr = np.asarray(latencies_ms, dtype=np.float64)
+    if not len(arr):
+        return {"p50": 0.0, "p99": 0.0, "mean": 0.0}
+    return {"p50": float(np.percentile(arr, 50)), "p99": float(np.percentile(arr, 99)), "mean": float(arr.mean())}
+
+
+def recall_at_k(retrieved, relevant, k):
+    """
+    :param retrieved: 检索到的id列表(已排序)
+    :param relevant: 参考id集合
+    """
+    relevant = set(relevant)
+    if not relevant:
+        return 1.0
+    return len(set(retrieved[:k]) & relevant) / len(relevant)
@@ -0,0 +1,86 @@
+import argparse
+import numpy as np
+from base import configs
+from managers.vector_store import VectorStore
+from managers import index_profiles
+from offline.retrieval_bench.bench_util import load_queries, timed, latency_stats, recall_at_k
+from utils.general_utils.loggers import logger
+
+# 精确检索基准时每次从milvus拉取的向量条数
+scan_batch_size = 2000
+
+
+def exact_top_k(vector_store, query_vectors, k):
+    """
+    遍历集合全部稠密向量 在本地算精确余弦top-k 作为召回率基准
+    :return: 每个查询的chunk id列表
+    """
+    iterator = vector_store.client.query_iterator(collection_name=vector_store.collection_name,
+                                                  batch_size=scan_batch_size,
+                                                  output_fields=["id", "dense_vector"])
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=object)
+    while True:
+        rows = iterator.next()
+        if not rows:
+            iterator.close()
+            break
+        vectors = np.asarray([r["dense_vector"] for r in rows], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # 与当前最优合并后只保留top-k
+        scores = np.concatenate([best_scores, queries @ vectors.T], axis=1)
+        ids = np.concatenate([best_ids, np.tile(np.asarray([r["id"] for r in rows], dtype=object),
+                                                (len(queries), 1))], axis=1)
+        keep = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_ids = np.take_along_axis(ids, keep, axis=1)
+    return [list(row) for row in best_ids]
+
+
+def dense_search(vector_store, query_vector, k, params):
+    results = vector_store.client.search(collection_name=vector_store.collection_name, data=[query_vector],
+                                         anns_field="dense_vector", limit=k,
+                                         search_params={"metric_type": "COSINE", "params": params})
+    return [hit["id"] for hit in results[0]]
+
+
+def sweep(vector_store, queries, k=configs.c, profile_name=None):
+    """
+    逐组检索参数测量稠密检索的 recall@k 与 p50/p99 延迟
+    :return: 按p50升序的 [{"params":..., "recall":..., "p50":..., "p99":..., "frontier": bool}]
+    """
+    query_vectors = [vector_store.embed_query(q["query"])["dense"][0] for q in queries]
+    truth = exact_top_k(vector_store, query_vectors, k)
+    points = []
+    for params in index_profiles.sweep_grid(profile_name):
+        # 每组参数先跑一遍预热 避免首轮加载影响延迟
+        dense_search(vector_store, query_vectors[0], k, params)
+        recalls, latencies = [], []
+        for vector, reference in zip(query_vectors, truth):
+            ids, ms = timed(dense_search, vector_store, vector, k, params)
+            recalls.append(recall_at_k(ids, reference, k))
+            latencies.append(ms)
+        points.append(dict(params=params, recall=float(np.mean(recalls)), **latency_stats(latencies)))
+    # 延迟-召回前沿: 没有其它参数组同时更快且召回更高
+    points.sort(key=lambda p: p["p50"])
+    best_recall = -1.0
+    for point in points:
+        point["frontier"] = point["recall"] > best_recall
+        best_recall = max(best_recall, point["recall"])
+    return points
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="扫描Milvus索引检索参数 输出召回率与延迟前沿")
+    parser.add_argument("--profile", default=index_profiles.index_profile, choices=list(index_profiles.INDEX_PROFILES))
+    parser.add_argument("--rebuild", action="store_true", help="先按配置档重建集合索引")
+    parser.add_argument("--k", type=int, default=configs.c)
+    args = parser.parse_args()
+    vs = VectorStore()
+    if args.rebuild:
+        vs.rebuild_index(args.profile)
+    for point in sweep(vs, load_queries(), args.k, args.profile):
+        logger.info(f"{'*' if point['frontier'] else ' '} {point['params']} recall@{args.k}={point['recall']:.3f} "
+                    f"p50={point['p50']:.2f}ms p99={point['p99']:.2f}ms")
@@ -1,6 +1,7 @@
 from online.mysql_search.bm25_search import BM25Search
+from online.mysql_search.faq_verifier import CrossEncoderVerifier
 from online.rag_system.rag_system import RAGSystem
-from managers.mysql_manager import MemeryManager
+from managers.session_memory import SessionMemory
 from utils.general_utils.time_util import timer
 
 history_k = 3
@@ -8,16 +9,21 @@ show_history_k = 10
 class EduQASystem:
     @timer
     def __init__(self):
-        self.bm25 = BM25Search()
         self.rag = RAGSystem()
-        self.memory = MemeryManager()
+        # FAQ候选用已加载的重排序模型确认 不再额外加载模型
+        self.bm25 = BM25Search(verifier=CrossEncoderVerifier(self.rag.vector_store.rerank_model))
+        # 客户端融合检索可选地把FAQ命中作为一路召回
+        self.rag.fusion.bm25 = self.bm25
+        # 最近几轮对话放在redis/进程内 写mysql在后台攒批完成
+        self.memory = SessionMemory()
     @timer
     def get_answer(self,query,session_id):
         answer = self.bm25.search(query)
         if answer:
             return answer
         else:
-            history = self.memory.search_history(session_id,history_k)
+            # 摘要+最近一轮(还没有摘要时为最近几轮) 由上下文拼装器按token预算取舍
+            history = self.memory.history_items(session_id,history_k)
             def streaming_with_memory():
                 answer_content = ''
                 for chunk in self.rag.generate_answer(query,history):
@@ -26,15 +32,28 @@ class EduQASystem:
                 self.memory.insert_memery(query,answer_content,session_id)
             return streaming_with_memory()
 
+    # 异步流式问答 FAQ命中时一次性返回答案
+    async def aget_answer(self,query,session_id):
+        answer = await self.bm25.asearch(query)
+        if answer:
+            yield answer
+            return
+        history = await self.memory.ahistory_items(session_id,history_k)
+        answer_content = ''
+        async for chunk in self.rag.agenerate_answer(query,history):
+            answer_content += chunk
+            yield chunk
+        await self.memory.ainsert_memery(query,answer_content,session_id)
+
     def clear_session(self, session_id):
-        self.memery.clear_memery(session_id)
+        self.memory.clear_memery(session_id)
     def new_session(self):
-        session_id = self.memery.new_session()
+        session_id = self.memory.new_session()
         return session_id
 
     # 切换会话
     def switch_session(self, session_id):
-        history = self.memery.search_history(session_id, show_history_k)
+        history = self.memory.search_history(session_id, show_history_k)
         return history
 if __name__ == '__main__':
     from utils.general_utils.globle_util import stream_print
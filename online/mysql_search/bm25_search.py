@@ -1,44 +1,116 @@
-from rank_bm25 import BM25Okapi
 import numpy as np
+import asyncio
 import jieba
+import os
 from managers import mysql_manager as mm #,redis_manager as rm
+from online.mysql_search.sparse_bm25 import SparseBM25
+from utils.general_utils.snapshot_util import prune_snapshots, snapshot_path
+from datas import filepaths as fp
 from utils.general_utils.time_util import timer
+from utils.general_utils.loggers import logger
+
+# BM25快照目录 每个jpkb校验和对应一个子目录
+SNAPSHOT_DIR = os.path.join(fp.FILES_DIR, 'bm25_snapshot')
+# 开启二次确认时取回的候选数，以及候选的最低softmax概率
+faq_top_k = 5
+candidate_thresold = 0.3
 
 class BM25Search:
-    def __init__(self):
+    def __init__(self,verifier=None):
+        """
+        :param verifier: 可选的FAQ候选确认器 见faq_verifier 为None时只用BM25概率判断
+        """
+        self.verifier = verifier
         self.bm25 = self._init_bm25()
     def _init_bm25(self):
+        # 优先加载与当前jpkb表一致的快照 多个worker共享mmap页
+        checksum = mm.QuestionManager.get_checksum()
+        path = snapshot_path(SNAPSHOT_DIR, checksum)
+        if checksum is not None:
+            bm25 = SparseBM25.load(path)
+            if bm25 is not None:
+                logger.info(f"加载BM25快照:{path}")
+                prune_snapshots(SNAPSHOT_DIR, path)
+                return bm25
+        bm25 = self._build_bm25()
+        if checksum is not None:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            bm25.save(path)
+            # FAQ每改一次校验和就变一次 只保留当前和上一个快照
+            prune_snapshots(SNAPSHOT_DIR, path)
+        return bm25
+    def _build_bm25(self):
         # 从Redis中获取所有问题
         # questions = rm.QuestionCache.get_all_questions()
         questions = False
         # 如果Redis中没有问题query，则从mysql数据库中加载数据
         if not questions:
-            questions = mm.QuestionManager.get_all_questions()
-        tokenized_questions = [jieba.lcut(q) for q in questions]
+            questions = mm.QuestionManager.get_all_question_rows()
         # 存储原始问题到Redis 略
-        # 初始化BM25模型
-        return BM25Okapi(tokenized_questions)
+        # 初始化BM25模型 以问题主键为文档id
+        bm25 = SparseBM25()
+        bm25.add_documents([q['id'] for q in questions], [jieba.lcut(q['question']) for q in questions])
+        bm25.merge()
+        return bm25
+
+    # FAQ增删改 不需要重建索引
+    def add_question(self,question_id,question):
+        self.bm25.add(question_id,jieba.lcut(question))
+
+    def update_question(self,question_id,question):
+        self.bm25.update(question_id,jieba.lcut(question))
+
+    def delete_question(self,question_id):
+        return self.bm25.delete(question_id)
     def _softmax(self,scores):
         exp_scores = np.exp(scores - np.max(scores))
         return exp_scores/exp_scores.sum()
-    def _bm_search(self,query):
-        scores = self.bm25.get_scores(jieba.lcut(query.lower()))
-        softmax_scores = self._softmax(scores)
-        best_idx = int(softmax_scores.argmax())
-        best_score = softmax_scores[best_idx]
-        return best_idx,best_score
+    # 返回按softmax概率降序的top-k [(问题id, 概率)]
+    def _bm_search(self,query,k=1):
+        # 打分、softmax与取top-k在索引的同一把锁内完成 不会和FAQ在线增删改交错
+        return self.bm25.top_k(jieba.lcut(query.lower()),k,transform=self._softmax)
+
+    # 选出需要去mysql取答案的候选
+    def _candidates(self,query,thresold):
+        if self.verifier is None:
+            # 没有二次确认 只信任top1
+            return [c for c in self._bm_search(query) if c[1] >= thresold]
+        return [c for c in self._bm_search(query,faq_top_k) if c[1] >= candidate_thresold]
+
+    # 在取回的问答中选出最终答案
+    def _pick_answer(self,query,candidates,faqs):
+        candidates = [c for c in candidates if c[0] in faqs]
+        if not candidates:
+            return None
+        if self.verifier is None:
+            return faqs[candidates[0][0]]['answer']
+        scores = self.verifier(query,[faqs[c[0]]['question'] for c in candidates])
+        best = int(np.argmax(scores))
+        logger.info(f"FAQ候选确认:{faqs[candidates[best][0]]['question']} 得分:{scores[best]:.3f}")
+        if scores[best] >= self.verifier.threshold:
+            return faqs[candidates[best][0]]['answer']
+        return None
     @timer
     def search(self,query,thresold=0.85):
-        # 这里转的很奇怪 回溯？ 改代码时看原代码 同时存在query和question
         # cached_answer = rm.AnswerCache.get_answer(query)
         # if cached_answer:
         #     return cached_answer
-        best_idx,best_score = self._bm_search(query)
-        if best_score >= thresold:
-            answer = mm.QuestionManager.get_anwear_by_question(query)
-            return answer
-        else:
+        candidates = self._candidates(query,thresold)
+        if not candidates:
+            return None
+        # 按主键一次取回所有候选的问答
+        faqs = mm.QuestionManager.get_faqs_by_ids([c[0] for c in candidates])
+        return self._pick_answer(query,candidates,faqs)
+
+    # 异步版本：打分放到线程里，查答案走异步mysql
+    async def asearch(self,query,thresold=0.85):
+        candidates = await asyncio.to_thread(self._candidates,query,thresold)
+        if not candidates:
             return None
+        faqs = await mm.QuestionManager.aget_faqs_by_ids([c[0] for c in candidates])
+        if self.verifier is None:
+            return self._pick_answer(query,candidates,faqs)
+        return await asyncio.to_thread(self._pick_answer,query,candidates,faqs)
 if __name__ == '__main__':
     bs = BM25Search()
     query = "请问可以帮我,看看简历可以吗?"
@@ -0,0 +1,35 @@
+import numpy as np
+
+# FAQ候选二次确认：对 (用户问题, 候选问题) 打分，分数达到阈值才直接返回FAQ答案
+
+
+class CrossEncoderVerifier:
+    """用重排序模型(bge-reranker)打分，输出已经过sigmoid，范围0~1"""
+
+    def __init__(self, rerank_model, threshold=0.8):
+        """
+        :param rerank_model: conn.rerank_conn.RerankModel 实例
+        :param threshold: 通过阈值
+        """
+        self.rerank_model = rerank_model
+        self.threshold = threshold
+
+    def __call__(self, query, questions):
+        return self.rerank_model.score(query, questions)
+
+
+class EmbeddingVerifier:
+    """用稠密向量的余弦相似度打分"""
+
+    def __init__(self, embedding_function, threshold=0.85):
+        """
+        :param embedding_function: BGEM3EmbeddingFunction 实例
+        :param threshold: 通过阈值
+        """
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+
+    def __call__(self, query, questions):
+        dense = np.asarray(self.embedding_function([query] + list(questions))["dense"], dtype=np.float32)
+        dense /= np.linalg.norm(dense, axis=1, keepdims=True) + 1e-12
+        return dense[1:] @ dense[0]
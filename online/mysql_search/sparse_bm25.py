@@ -0,0 +1,307 @@
+import numpy as np
+from scipy import sparse
+from utils.general_utils.snapshot_util import read_snapshot, write_snapshot
+import threading
+
+# 待合并的新文档数超过该值(或占比超过merge_ratio)时合并进主索引
+merge_min = 1024
+merge_ratio = 0.05
+# 被删除的文档占比超过该值时压缩主索引
+dead_ratio = 0.2
+# 快照格式版本 字段有变化时加1 旧快照会被忽略
+snapshot_version = 1
+
+
+class SparseBM25:
+    """
+    稀疏矩阵版BM25, 打分公式与rank_bm25.BM25Okapi一致
+    主索引为 词x文档 的CSR(每行即一个词的倒排表), 存的是已经带上长度归一化的词频权重,
+    查询时只需要 idf加权的查询向量 与 命中词的行 做一次稀疏矩阵乘法
+    增删改不需要重建: 新文档先进入待合并区, 删除只打标记, 积累到一定量后再用缓存的词频合并
+    增删改、合并与查询共用一把锁, 在线更新FAQ时线程池里的查询不会看到改了一半的索引
+    """
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = {}  # 词 -> 词id
+        self.doc_ids = []  # 槽位 -> 外部文档id
+        self.id2slot = {}  # 外部文档id -> 槽位
+        self.doc_terms = []  # 槽位 -> 词id数组
+        self.doc_tfs = []  # 槽位 -> 词频数组
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.df = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        # 主索引覆盖的槽位数, 之后的槽位都在待合并区
+        self.main_n = 0
+        self.avgdl = 0.0
+        self.postings = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.pending = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._idf_dirty = True
+        self._pending_dirty = True
+        # 从快照加载时, 每个文档的词id/词频先以扁平数组保存, 增删改时才拆分
+        self._flat_docs = None
+        # 可重入: add_documents/delete 内部会调用 merge
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.id2slot)
+
+    # ------------------ 写入 ------------------
+    def add_documents(self, ids, tokenized_docs):
+        """
+        :param ids: 外部文档id列表 示例 ['id1','id2']
+        :param tokenized_docs: 分词后的文档列表 示例 [['问题','1'],['问题','2']]
+        """
+        ids = list(ids)
+        tokenized_docs = list(tokenized_docs)
+        with self._lock:
+            self._add_documents(ids, tokenized_docs)
+
+    def _add_documents(self, ids, tokenized_docs):
+        self._ensure_docs()
+        # 先占好槽位 同一批里重复的id也能正确覆盖
+        self.doc_len = np.concatenate([self.doc_len, np.asarray([len(t) for t in tokenized_docs], dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        for doc_id, tokens in zip(ids, tokenized_docs):
+            if doc_id in self.id2slot:
+                self._remove_slot(self.id2slot.pop(doc_id))
+            terms, tfs = self._encode(tokens)
+            self.id2slot[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_terms.append(terms)
+            self.doc_tfs.append(tfs)
+            self.df[terms] += 1
+        self._idf_dirty = True
+        self._pending_dirty = True
+        self._maybe_merge()
+
+    def add(self, doc_id, tokens):
+        self.add_documents([doc_id], [tokens])
+
+    # 更新即先删后加
+    def update(self, doc_id, tokens):
+        self.add_documents([doc_id], [tokens])
+
+    def delete(self, doc_id):
+        with self._lock:
+            slot = self.id2slot.pop(doc_id, None)
+            if slot is None:
+                return False
+            self._ensure_docs()
+            self._remove_slot(slot)
+            self._maybe_merge()
+            return True
+
+    def _remove_slot(self, slot):
+        self.alive[slot] = False
+        self.df[self.doc_terms[slot]] -= 1
+        self._idf_dirty = True
+
+    # 词转id并统计词频 新词扩充词表
+    def _encode(self, tokens):
+        ids = []
+        for token in tokens:
+            tid = self.vocab.get(token)
+            if tid is None:
+                tid = self.vocab[token] = len(self.vocab)
+            ids.append(tid)
+        if len(self.vocab) > len(self.df):
+            self.df = np.concatenate([self.df, np.zeros(len(self.vocab) - len(self.df), dtype=np.int32)])
+        if not ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        terms, tfs = np.unique(np.asarray(ids, dtype=np.int32), return_counts=True)
+        return terms, tfs.astype(np.float32)
+
+    # ------------------ 索引维护 ------------------
+    def _maybe_merge(self):
+        n = len(self.doc_ids)
+        pending_n = n - self.main_n
+        dead_n = n - len(self.id2slot)
+        if pending_n > max(merge_min, merge_ratio * self.main_n) or dead_n > dead_ratio * max(n, 1):
+            self.merge()
+
+    def merge(self):
+        """把待合并区并入主索引, 同时丢弃已删除的槽位并按当前平均文档长度重算权重"""
+        with self._lock:
+            self._merge()
+
+    def _merge(self):
+        self._ensure_docs()
+        keep = np.flatnonzero(self.alive)
+        self.doc_ids = [self.doc_ids[i] for i in keep]
+        self.doc_terms = [self.doc_terms[i] for i in keep]
+        self.doc_tfs = [self.doc_tfs[i] for i in keep]
+        self.doc_len = self.doc_len[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.id2slot = {doc_id: slot for slot, doc_id in enumerate(self.doc_ids)}
+        self.avgdl = float(self.doc_len.mean()) if len(keep) else 0.0
+        self.postings = self._build_matrix(0, len(self.doc_ids))
+        self.main_n = len(self.doc_ids)
+        self.pending = self._build_matrix(self.main_n, self.main_n)
+        self._pending_dirty = False
+        self._idf_dirty = True
+
+    # 构建[start,end)槽位的 词x文档 权重矩阵
+    def _build_matrix(self, start, end):
+        n_docs = end - start
+        n_terms = len(self.vocab)
+        if n_docs <= 0:
+            return sparse.csr_matrix((n_terms, 0), dtype=np.float32)
+        terms = self.doc_terms[start:end]
+        tfs = np.concatenate(self.doc_tfs[start:end])
+        rows = np.concatenate(terms)
+        cols = np.repeat(np.arange(n_docs, dtype=np.int32), [len(t) for t in terms])
+        avgdl = self.avgdl or float(self.doc_len[start:end].mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[start:end] / avgdl)
+        weights = tfs * (self.k1 + 1) / (tfs + norm[cols])
+        return sparse.csr_matrix((weights, (rows, cols)), shape=(n_terms, n_docs), dtype=np.float32)
+
+    # 与BM25Okapi一致: 负idf用平均idf*epsilon兜底
+    def _refresh(self):
+        if self._idf_dirty:
+            n = len(self.id2slot)
+            df = self.df.astype(np.float32)
+            idf = np.log(n - df + 0.5) - np.log(df + 0.5) if n else np.zeros_like(df)
+            present = self.df > 0
+            avg_idf = idf[present].mean() if present.any() else 0.0
+            idf[idf < 0] = self.epsilon * avg_idf
+            idf[~present] = 0.0
+            self.idf = idf.astype(np.float32)
+            self._idf_dirty = False
+        if self._pending_dirty:
+            self.pending = self._build_matrix(self.main_n, len(self.doc_ids))
+            self._pending_dirty = False
+
+    # 把快照里的扁平数组拆回每个文档一份
+    def _ensure_docs(self):
+        if self._flat_docs is None:
+            return
+        terms, tfs, offsets = self._flat_docs
+        self.doc_terms = np.split(np.asarray(terms), offsets[1:-1])
+        self.doc_tfs = np.split(np.asarray(tfs), offsets[1:-1])
+        self.df = np.array(self.df)
+        self.doc_len = np.array(self.doc_len)
+        self._flat_docs = None
+
+    # ------------------ 快照 ------------------
+    def save(self, path):
+        """
+        保存为目录快照, 数组存成.npy方便load时mmap, 先写临时目录再改名保证原子性
+        :param path: 快照目录
+        :return: True 写入成功 / False 目录已被其他进程写入
+        """
+        with self._lock:
+            self._merge()
+            return self._save(path)
+
+    def _save(self, path):
+        offsets = np.zeros(len(self.doc_terms) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in self.doc_terms], out=offsets[1:])
+        arrays = {
+            "terms": np.concatenate(self.doc_terms) if self.doc_terms else np.zeros(0, dtype=np.int32),
+            "tfs": np.concatenate(self.doc_tfs) if self.doc_tfs else np.zeros(0, dtype=np.float32),
+            "offsets": offsets,
+            "doc_len": self.doc_len,
+            "df": self.df,
+            "data": self.postings.data,
+            "indices": self.postings.indices,
+            "indptr": self.postings.indptr,
+        }
+        meta = {
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "avgdl": self.avgdl,
+            "shape": list(self.postings.shape),
+            "vocab": list(self.vocab),
+            "doc_ids": self.doc_ids,
+        }
+        return write_snapshot(path, arrays, meta, snapshot_version)
+
+    @classmethod
+    def load(cls, path):
+        """
+        以mmap方式加载快照, 多个进程共享同一份页缓存
+        :param path: 快照目录
+        :return: SparseBM25 实例, 快照不存在或版本不符时返回None
+        """
+        snapshot = read_snapshot(path, ("terms", "tfs", "offsets", "doc_len", "df", "data", "indices", "indptr"),
+                                 snapshot_version)
+        if snapshot is None:
+            return None
+        meta, arrays = snapshot
+        bm25 = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        bm25.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        bm25.doc_ids = meta["doc_ids"]
+        bm25.id2slot = {doc_id: slot for slot, doc_id in enumerate(bm25.doc_ids)}
+        bm25.doc_len = arrays["doc_len"]
+        bm25.df = arrays["df"]
+        bm25.alive = np.ones(len(bm25.doc_ids), dtype=bool)
+        bm25.avgdl = meta["avgdl"]
+        bm25.main_n = len(bm25.doc_ids)
+        bm25.postings = sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                          shape=tuple(meta["shape"]), copy=False)
+        bm25.pending = sparse.csr_matrix((len(bm25.vocab), 0), dtype=np.float32)
+        bm25._pending_dirty = False
+        bm25._flat_docs = (arrays["terms"], arrays["tfs"], arrays["offsets"])
+        return bm25
+
+    # ------------------ 查询 ------------------
+    def get_scores(self, query_tokens):
+        """
+        :param query_tokens: 分词后的查询
+        :return: 与doc_ids槽位对齐的得分数组, 已删除的槽位为 -inf
+        """
+        with self._lock:
+            return self._get_scores(query_tokens)
+
+    def _get_scores(self, query_tokens):
+        self._refresh()
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        ids = [self.vocab[t] for t in query_tokens if t in self.vocab]
+        if ids:
+            # 查询里重复的词按次数累加 与BM25Okapi一致
+            terms, counts = np.unique(np.asarray(ids, dtype=np.int32), return_counts=True)
+            weights = self.idf[terms] * counts
+            main_terms = terms < self.postings.shape[0]
+            if self.main_n and main_terms.any():
+                scores[:self.main_n] = self.postings[terms[main_terms]].T @ weights[main_terms]
+            if self.pending.shape[1]:
+                scores[self.main_n:] = self.pending[terms].T @ weights
+        scores[~self.alive] = -np.inf
+        return scores
+
+    def top_k(self, query_tokens, k=5, transform=None):
+        """
+        :param query_tokens: 分词后的查询
+        :param k: 返回数量
+        :param transform: 可选的得分变换 如softmax 与打分、取top-k在同一次加锁内完成
+        :return: 按得分降序的 [(文档id, 得分)]
+        """
+        with self._lock:
+            scores = self._get_scores(query_tokens)
+            if transform is not None and len(scores):
+                scores = transform(scores)
+            return self._top_k_from_scores(scores, k)
+
+    # 对已算好的得分取top-k 跳过已删除的槽位
+    # 得分须与当前槽位对齐 打分后索引可能已被修改时请用 top_k(transform=...)
+    def top_k_from_scores(self, scores, k=5):
+        with self._lock:
+            if len(scores) != len(self.doc_ids):
+                raise ValueError("得分数组与当前索引槽位不一致 索引在打分后已被修改")
+            return self._top_k_from_scores(scores, k)
+
+    # 按alive掩码过滤 不依赖得分是否为-inf(softmax等变换后已删除的槽位得分是有限值)
+    def _top_k_from_scores(self, scores, k):
+        candidates = np.flatnonzero(self.alive)
+        k = min(k, len(candidates))
+        if k <= 0:
+            return []
+        candidate_scores = scores[candidates]
+        order = np.argpartition(-candidate_scores, k - 1)[:k]
+        order = order[np.argsort(-candidate_scores[order], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in candidates[order] if np.isfinite(scores[i])]
@@ -0,0 +1,121 @@
+from conn import inference_backend
+from managers.mysql_manager import MemeryManager
+from utils.general_utils.loggers import logger
+import threading
+
+# 提示词的近似token预算(模板+问题+上下文+历史)
+# 计数用的是本地分词器 不是生成模型(deepseek/qwen)的分词器 两者对中文的切分有差异
+# 所以只按预算的 (1 - token_safety_margin) 装填 给计数误差留余量
+approx_prompt_token_budget = 4096
+token_safety_margin = 0.15
+# 放不下完整内容时 剩余预算不少于这么多token才截断放入 否则直接丢弃
+min_chunk_tokens = 64
+# 计数用的本地分词器 默认与嵌入模型共用 不需要联网; 有生成模型的分词器时改成它的目录即可精确计数
+TOKENIZER_DIR = inference_backend.BGE_M3_DIR
+
+
+class ContextAssembler:
+    """
+    按token预算拼装提示词: 先放排序靠前的父文档, 剩余预算再放最近的对话,
+    更早的历史截断或丢弃; 每次请求的token用量(本地分词器的估算值)写日志并累计统计
+    """
+
+    def __init__(self, budget=approx_prompt_token_budget, tokenizer_dir=TOKENIZER_DIR,
+                 safety_margin=token_safety_margin):
+        """
+        :param budget: 近似token预算
+        :param tokenizer_dir: 计数用的分词器目录
+        :param safety_margin: 分词器与生成模型不一致时预留的比例 用同一个分词器时可设为0
+        """
+        self.budget = int(budget * (1 - safety_margin))
+        self.tokenizer_dir = tokenizer_dir
+        self._tokenizer = None
+        self._template_tokens = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.totals = {"prompt_tokens": 0, "context_tokens": 0, "history_tokens": 0,
+                       "dropped_docs": 0, "dropped_turns": 0}
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_dir)
+        return self._tokenizer
+
+    def count(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"]) if text else 0
+
+    # 模板本身的token数 每个模板只算一次
+    def template_tokens(self, template):
+        if template not in self._template_tokens:
+            self._template_tokens[template] = self.count(template)
+        return self._template_tokens[template]
+
+    def _fill(self, texts, budget):
+        """
+        按顺序放入文本直到预算用完
+        :return: (放入的文本, 用掉的token数, 截断数, 丢弃数)
+        """
+        if not texts:
+            return [], 0, 0, 0
+        encoded = self.tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True)
+        kept, used, truncated = [], 0, 0
+        for text, offsets in zip(texts, encoded["offset_mapping"]):
+            remaining = budget - used
+            if len(offsets) <= remaining:
+                kept.append(text)
+                used += len(offsets)
+                continue
+            if remaining >= min_chunk_tokens:
+                kept.append(text[:offsets[remaining - 1][1]])
+                used += remaining
+                truncated += 1
+            break
+        return kept, used, truncated, len(texts) - len(kept)
+
+    @staticmethod
+    def _history_texts(history):
+        # 历史可以是拼好的字符串 或 按时间倒序的 [{'question':..., 'answer':...}] / 字符串 列表
+        if not history:
+            return []
+        if isinstance(history, str):
+            return [history]
+        return [turn if isinstance(turn, str) else MemeryManager._format_history([turn]) for turn in history]
+
+    def assemble(self, query, contexts=(), history=None, template=""):
+        """
+        :param query: 问题
+        :param contexts: 按相关性降序的父文档
+        :param history: 对话历史 最近的在前
+        :param template: 提示词模板 用于扣除模板本身的token
+        :return: {"context": str, "history": str, "stats": {...}}
+        """
+        question_tokens = self.count(query)
+        budget = max(self.budget - self.template_tokens(template) - question_tokens, 0)
+        docs, context_tokens, docs_truncated, docs_dropped = self._fill(list(contexts), budget)
+        turns, history_tokens, turns_truncated, turns_dropped = self._fill(
+            self._history_texts(history), budget - context_tokens)
+        stats = {
+            "prompt_tokens": self.template_tokens(template) + question_tokens + context_tokens + history_tokens,
+            "context_tokens": context_tokens, "history_tokens": history_tokens,
+            "docs": len(docs), "dropped_docs": docs_dropped, "truncated_docs": docs_truncated,
+            "turns": len(turns), "dropped_turns": turns_dropped, "truncated_turns": turns_truncated,
+        }
+        self._record(stats)
+        logger.info(f"提示词token(估算):{stats}")
+        return {"context": '\n\n'.join(docs), "history": ''.join(turns), "stats": stats}
+
+    def _record(self, stats):
+        with self._lock:
+            self.requests += 1
+            for key in self.totals:
+                self.totals[key] += stats[key]
+
+    # 累计的平均用量
+    def stats(self):
+        with self._lock:
+            n = self.requests
+            return {"requests": n, **{f"avg_{key}": value / n if n else 0.0 for key, value in self.totals.items()}}
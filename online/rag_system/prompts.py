@@ -37,4 +37,22 @@ class RAGPrompts:
             **对话历史**:{history}
             **问题**:{query}
             """
-        )
\ No newline at end of file
+        )
+    @staticmethod
+    def summary_prompt():
+        """
+        会话滚动摘要提示词
+        :return:
+        """
+        return PromptTemplate(
+            template = """
+            请把已有的对话摘要和最新一轮对话合并成新的摘要。
+            - 保留用户关心的主题、关键事实、未解决的问题和用户偏好
+            - 去掉寒暄和重复内容，不要编造
+            - 只输出摘要本身，不超过{max_chars}字
+            **已有摘要**:{summary}
+            **最新问题**:{question}
+            **最新回答**:{answer}
+            **新摘要**:
+            """
+        )
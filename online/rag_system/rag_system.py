@@ -1,60 +1,163 @@
 from base import configs as cfg
 from managers import vector_store as vs
-from conn.llms import get_deepseek
+from managers.redis_manager import SemanticAnswerCache
+from managers.cascade_retriever import CascadeRetriever
+from managers.client_fusion import FusionRetriever
+from managers.subject_router import SubjectRouter
+import asyncio
+import redis
+from conn.llms import get_llm
+from conn.llm_router import LLMRouter
 from langchain_core.output_parsers import StrOutputParser
 from utils.general_utils.time_util import timer
 from online.rag_system.prompts import RAGPrompts
+from online.rag_system.context_assembler import ContextAssembler
 # from online.rag_system.query_classifier import Classifier
 # from online.rag_system.strategy_selector import QueryStrategy
 from utils.general_utils.loggers import logger
 
+# 检索模式: "hybrid" 仅混合检索 / "rerank" 混合检索+完整重排序 / "cascade" 级联, 按需重排序
+# "fusion" 稠密/稀疏两路并发检索 客户端融合 / None 不检索 直接用通用提示词回答
+retrieval_mode = "hybrid"
+# 生成用的LLM: 单个提供方 如 "deepseek" / "router" 在 llm_router.router_providers 间按首token延迟与错误率路由
+# 开启router后流量会发往列表中的所有提供方(默认含SiliconFlow) 需确认各提供方的密钥与数据合规后再开启
+llm_provider = "deepseek"
+
 class RAGSystem:
     @timer
     def __init__(self):
         # 向量数据库
         self.vector_store = vs.VectorStore()
+        self.cascade = CascadeRetriever(self.vector_store)
+        # BM25在EduQASystem里创建后再挂上
+        self.fusion = FusionRetriever(self.vector_store)
+        # 学科路由 只检索相关学科的分区
+        self.subject_router = SubjectRouter()
+        # 语义答案缓存 复用检索用的BGE-M3稠密向量
+        self.answer_cache = SemanticAnswerCache(lambda q: self.vector_store.embed_query(q)["dense"][0])
         # 设置chain
-        llm = get_deepseek()
+        llm = LLMRouter() if llm_provider == "router" else get_llm(llm_provider)
         parser = StrOutputParser()
+        self.rag_template = RAGPrompts.rag_prompt().template
+        self.general_template = RAGPrompts.general_prompt().template
         self.rag_chain = RAGPrompts.rag_prompt()|llm|parser
         self.general_chain = RAGPrompts.general_prompt()|llm|parser
+        # 按token预算裁剪上下文和历史
+        self.assembler = ContextAssembler()
         # 检索策略
         # self.qs = QueryStrategy()
         # self.query_classifier = Classifier()
     # 获取检索到的文档
-    def _get_context(self,query):
+    def _get_context(self,query,subject=None):
+        """
+        :param subject: 显式指定的学科 为None时由学科分类器判断 判断不出则检索全部
+        """
         # 获取上下文milvus数据库?
         # new_query = self.qs.get_new_query(query)
         logger.info(f"query:{query}")
+        subjects = self.subject_router.route(query,subject)
         # 子查询检索 略
-        context_docs = self.vector_store.hybrid_search(query)# 略了一个重排序 直接用了hybridsearch
+        if retrieval_mode == "cascade":
+            return self.cascade.search(query,subjects=subjects)
+        if retrieval_mode == "fusion":
+            return self.fusion.search(query,subjects=subjects)
+        if retrieval_mode == "rerank":
+            return self.vector_store.hybrid_search_with_rerank(query,subjects=subjects)
+        context_docs = self.vector_store.hybrid_search(query,subjects=subjects)# 略了一个重排序 直接用了hybridsearch
         return context_docs
-    @timer
-    def _rag_query(self,query,history):
-        contexts = self._get_context(query)
-        context = '\n\n'.join(contexts)
-        input = {
-            "context":context,
+
+    async def _aget_context(self,query,subject=None):
+        logger.info(f"query:{query}")
+        subjects = self.subject_router.route(query,subject)
+        if retrieval_mode == "cascade":
+            return await self.cascade.asearch(query,subjects=subjects)
+        if retrieval_mode == "fusion":
+            return await self.fusion.asearch(query,subjects=subjects)
+        if retrieval_mode == "rerank":
+            return await asyncio.to_thread(self.vector_store.hybrid_search_with_rerank,query,subjects=subjects)
+        return await self.vector_store.ahybrid_search(query,subjects=subjects)
+    # 按预算拼出rag_prompt的输入
+    def _rag_input(self,query,contexts,history):
+        assembled = self.assembler.assemble(query,contexts,history,self.rag_template)
+        return {
+            "context":assembled["context"],
             "question":query,
             "phone":cfg.CUSTOMER_SERVICE_PHONE,
-            "history":history
+            "history":assembled["history"]
         }
-        return self.rag_chain.stream(input)
+
+    def _general_input(self,query,history):
+        return {"query":query,"history":self.assembler.assemble(query,history=history,template=self.general_template)["history"]}
+
+    @timer
+    def _rag_query(self,query,history,subject=None):
+        contexts = self._get_context(query,subject)
+        return self.rag_chain.stream(self._rag_input(query,contexts,history))
+
+    # 异步版本 返回异步生成器
+    async def _arag_query(self,query,history,subject=None):
+        contexts = await self._aget_context(query,subject)
+        rag_input = await asyncio.to_thread(self._rag_input,query,contexts,history)
+        return self.rag_chain.astream(rag_input)
+    # 语义缓存只按问题命中 带历史的追问(如"那第二题呢")答案依赖会话上下文 不查也不存
+    def _cache_get(self,query,history):
+        if history:
+            return None
+        try:
+            return self.answer_cache.get(query)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"语义缓存读取失败 直接调用LLM:{e}")
+            return None
+
+    def _cache_set(self,query,history,answer):
+        if history:
+            return
+        try:
+            self.answer_cache.set(query,answer)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"语义缓存写入失败:{e}")
+
     @timer
     def generate_answer(self,query,history=''):
-        # 生成答案这里跳了 一截
-        return self.general_chain.stream({"query":query,"history":history})
+        # 语义缓存命中直接返回 不再调用LLM
+        cached = self._cache_get(query,history)
+        if cached is not None:
+            return iter([cached])
+        if retrieval_mode:
+            stream = self._rag_query(query,history)
+        else:
+            stream = self.general_chain.stream(self._general_input(query,history))
+        return self._cache_stream(query,history,stream)
+
+    # 边流式输出边拼接完整答案 结束后写入缓存
+    def _cache_stream(self,query,history,stream):
+        answer = ''
+        for chunk in stream:
+            answer += chunk
+            yield chunk
+        self._cache_set(query,history,answer)
+
+    async def agenerate_answer(self,query,history=''):
+        cached = await asyncio.to_thread(self._cache_get,query,history)
+        if cached is not None:
+            yield cached
+            return
+        # 检索走异步milvus客户端/级联/融合的异步路径 不占事件循环
+        if retrieval_mode:
+            stream = await self._arag_query(query,history)
+        else:
+            general_input = await asyncio.to_thread(self._general_input,query,history)
+            stream = self.general_chain.astream(general_input)
+        answer = ''
+        async for chunk in stream:
+            answer += chunk
+            yield chunk
+        await asyncio.to_thread(self._cache_set,query,history,answer)
     # 完整输出 方便评估
-    def _rag_query_evaluation(self,query,history=''):
-        contexts = self._get_context(query)
-        context = '\n\n'.join(contexts)
-        input = {
-            "context":context,
-            "question" : query,
-            "phone" : cfg.CUSTOMER_SERVICE_PHONE,
-            "history":history
-        }
-        return self.rag_chain.invoke(input),context
+    def _rag_query_evaluation(self,query,history='',subject=None):
+        contexts = self._get_context(query,subject)
+        rag_input = self._rag_input(query,contexts,history)
+        return self.rag_chain.invoke(rag_input),rag_input["context"]
     def for_evaluation(self,query,history=''):
         # 这里集成了一下 前面略了故直接返回
         return self._rag_query_for_evaluation(query,history)
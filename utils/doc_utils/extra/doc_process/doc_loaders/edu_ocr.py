@@ -1,4 +1,5 @@
 import os,paddle
+from functools import lru_cache
 '''
 paddleocr：解析图片中的文字，也可以进行表格识别
 rapidocr_paddle 和 rapidocr_onnxruntime 两种导入方式
@@ -8,6 +9,8 @@ rapidocr_paddle 和 rapidocr_onnxruntime 两种导入方式
 当只有 CPU 且需要高效推理时：使用 rapidocr_onnxruntime。它在 CPU 上进行了优化，资源占用较低.
 '''
 
+# 每个进程只初始化一次OCR引擎，多进程解析时各worker持有自己的实例
+@lru_cache(maxsize=None)
 def get_ocr(use_cuda: bool = True):
     # paddle_dir = os.path.dirname(os.path.dirname(paddle.__file__))
     # # 构建正确的 cudnn bin 目录路径
@@ -8,11 +8,13 @@ from doc_loaders.edu_docloader import OCRDOCLoader
 from doc_loaders.edu_imgloader import OCRIMGLoader
 from doc_loaders.edu_pdfloader import OCRPDFLoader
 from doc_loaders.edu_pptloader import OCRPPTLoader
+from doc_loaders import edu_pdfloader, edu_docloader
 
 from text_splitters.edu_chinese_recursive_text_splitter import ChineseRecursiveTextSplitter
 #from text_splitters.edu_model_text_spliter import AliTextSplitter
 
 from base.config_gen import RETRIEVAL as conf
+from utils.general_utils.pipeline_util import ordered_process_map
 
 import logging
 
@@ -36,46 +38,65 @@ document_loaders = {
     ".md": UnstructuredMarkdownLoader
 }
 
+# 加载单个文件并添加元数据 多进程时在子进程中执行
+def load_one_document(args):
+    file_path, source = args
+    # 获取文件扩展名并转换为小写
+    file_extension = os.path.splitext(file_path)[1].lower()
+    # 检查文件类型是否在支持的扩展名列表中
+    loader_class = document_loaders[file_extension]
+    # 实例化加载器对象，传入文件路径
+    if file_extension == ".txt":
+        loader = loader_class(file_path, encoding="utf-8")
+    else:
+        loader = loader_class(file_path)
+    print(loader)
+    print(file_path)
+    # 调用加载器加载文档内容，返回文档列表
+    loaded_docs = loader.load()
+    # 遍历加载的每个文档
+    for doc in loaded_docs:
+        # 为文档添加学科类别元数据
+        doc.metadata["source"] = source
+        # 为文档添加文件路径元数据
+        doc.metadata["file_path"] = file_path
+        # 为文档添加当前时间戳元数据
+        doc.metadata["timestamp"] = datetime.now().isoformat()
+    # 记录成功加载文件的日志
+    print(f"成功加载文件: {file_path}")
+    return loaded_docs
+
+# 子进程启动时先初始化OCR引擎 之后该进程内的文件都复用它
+# pdf加载器与doc/img/ppt加载器导入get_ocr的路径不同, 通过加载器模块里的引用预热,
+# 保证预热的就是解析时实际调用的那个缓存实例
+def _init_worker():
+    for get_ocr in {edu_pdfloader.get_ocr, edu_docloader.get_ocr}:
+        get_ocr()
+
 # 定义函数，从指定文件夹加载多种类型文件并添加元数据
-def load_documents_from_directory(directory_path):
-    # 初始化空列表，用于存储加载的文档
-    documents = []
-    # 获取支持的文件扩展名集合
-    supported_extensions = document_loaders.keys()
+def load_documents_from_directory(directory_path, workers=1):
+    """
+    :param directory_path: 文件目录
+    :param workers: 解析进程数 大于1时多进程解析, 结果顺序与单进程一致
+    """
     # 从目录名提取学科类别（如 "ai_data" -> "ai"）
     source = os.path.basename(directory_path).replace("_data", "")
+    # 遍历指定目录及其子目录 排序保证顺序稳定
+    tasks = []
+    for root, dirs, files in os.walk(directory_path):
+        dirs.sort()
+        for file in sorted(files):
+            tasks.append((os.path.join(root, file), source))
 
-    # 遍历指定目录及其子目录
-    for root, _, files in os.walk(directory_path):
-        # 遍历当前目录下的所有文件
-        for file in files:
-            # 构造文件的完整路径
-            file_path = os.path.join(root, file)
-            # 获取文件扩展名并转换为小写
-            file_extension = os.path.splitext(file_path)[1].lower()
-            # 检查文件类型是否在支持的扩展名列表中
-            loader_class = document_loaders[file_extension]
-            # 实例化加载器对象，传入文件路径
-            if file_extension == ".txt":
-                loader = loader_class(file_path, encoding="utf-8")
-            else:
-                loader = loader_class(file_path)
-            print(loader)
-            print(file_path)
-            # 调用加载器加载文档内容，返回文档列表
-            loaded_docs = loader.load()
-            # 遍历加载的每个文档
-            for doc in loaded_docs:
-                # 为文档添加学科类别元数据
-                doc.metadata["source"] = source
-                # 为文档添加文件路径元数据
-                doc.metadata["file_path"] = file_path
-                # 为文档添加当前时间戳元数据
-                doc.metadata["timestamp"] = datetime.now().isoformat()
-            # 将加载的文档添加到总列表中
-            documents.extend(loaded_docs)
-            # 记录成功加载文件的日志
-            print(f"成功加载文件: {file_path}")
+    # 初始化空列表，用于存储加载的文档
+    documents = []
+    if workers <= 1:
+        results = map(load_one_document, tasks)
+    else:
+        results = ordered_process_map(load_one_document, tasks, workers, initializer=_init_worker)
+    for loaded_docs in results:
+        # 将加载的文档添加到总列表中
+        documents.extend(loaded_docs)
 
     # 返回加载的所有文档列表
     return documents
@@ -83,9 +104,10 @@ def load_documents_from_directory(directory_path):
 # 定义函数，处理文档并进行分层切分，返回子块结果
 def process_documents(directory_path, parent_chunk_size=conf.PARENT_CHUNK_SIZE,
                      child_chunk_size=conf.CHILD_CHUNK_SIZE,
-                     chunk_overlap=conf.CHUNK_OVERLAP):
+                     chunk_overlap=conf.CHUNK_OVERLAP,
+                     workers=1):
     # 从指定目录加载所有文档
-    documents = load_documents_from_directory(directory_path)
+    documents = load_documents_from_directory(directory_path, workers)
     # 记录加载的文档总数日志
     print(f"加载的文档数量: {len(documents)}")
 
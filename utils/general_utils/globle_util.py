@@ -5,6 +5,22 @@ import hashlib
 def gen_hash(text):
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+# 父块id: 按来源文件+内容寻址 同一文件内容不变id就不变
+def gen_parent_id(source, content):
+    return gen_hash(f"{source}\x00{content}")
+
+# 子块id: 由父块id和子块序号确定
+def gen_child_id(parent_id, index):
+    return f"{parent_id}-{index}"
+
+# 分块计算文件内容的hash 大文件不用整读进内存
+def gen_file_hash(file_path, block_size=1 << 20):
+    h = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
 # 流式打印
 def stream_print(generator):
     for chunk in generator:
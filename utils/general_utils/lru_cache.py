@@ -0,0 +1,66 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """线程安全的有界LRU缓存 可选过期时间"""
+
+    def __init__(self, max_entries=1024, ex=None):
+        """
+        :param max_entries: 最大条数
+        :param ex: 过期时间（秒） None为不过期
+        """
+        self.max_entries = max_entries
+        self.ex = ex
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # 批量读取 返回 (命中的字典, 未命中的key列表)
+    def get_many(self, keys):
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key, value):
+        expire_at = time.time() + self.ex if self.ex else None
+        with self._lock:
+            self.entries[key] = (value, expire_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "size": len(self.entries)}
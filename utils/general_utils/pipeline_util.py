@@ -0,0 +1,87 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import queue
+import threading
+
+_END = object()
+
+
+# 按固定大小切分任意可迭代对象 最后一批可能不足n条
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bounded_iter(iterable, maxsize=4):
+    """
+    在后台线程中消费iterable, 通过定长队列交给调用方, 上下游可以并行且内存中最多积压maxsize个元素
+    :param iterable: 上游可迭代对象(生成器)
+    :param maxsize: 队列长度
+    :return: 生成器 上游抛出的异常会在这里重新抛出
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                q.put(item)
+            q.put(_END)
+        except BaseException as e:
+            q.put(e)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 下游提前退出时让生产线程停下 并腾出队列位置避免其阻塞
+        stop.set()
+        while worker.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                worker.join(0.01)
+
+
+def ordered_process_map(fn, items, workers=4, initializer=None, window=None):
+    """
+    多进程并行处理, 按输入顺序流式返回结果
+    同时在途的任务最多window个, 已完成但还没轮到的结果不会无限堆积
+    :param fn: 顶层函数(需可pickle)
+    :param items: 输入的可迭代对象
+    :param workers: 进程数
+    :param initializer: 每个进程启动时执行一次 用于加载OCR等重资源
+    :param window: 在途任务数 默认workers*2
+    """
+    window = window or workers * 2
+    # 父进程里已经有torch/grpc等线程, fork容易死锁, 统一用spawn
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+if __name__ == '__main__':
+    for b in bounded_iter(batched(range(10), 3), 2):
+        print(b)
@@ -0,0 +1,83 @@
+import numpy as np
+import shutil
+import json
+import time
+import uuid
+import os
+
+
+# 快照目录结构: <snapshot_dir>/jpkb_<校验和>/{meta.json, <数组名>.npy}
+def snapshot_path(snapshot_dir, checksum):
+    return os.path.join(snapshot_dir, f"jpkb_{checksum}")
+
+
+def write_snapshot(path, arrays, meta, version):
+    """
+    写入目录快照 数组存成.npy方便读取时mmap, 先写临时目录再改名保证原子性
+    :param path: 快照目录
+    :param arrays: {数组名: np.ndarray}
+    :param meta: 可json序列化的元数据
+    :param version: 快照格式版本 读取时不一致则忽略
+    :return: True 写入成功 / False 目录已被其他进程写入
+    """
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), arr)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({**meta, "version": version}, f, ensure_ascii=False)
+    try:
+        os.rename(tmp, path)
+        return True
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+
+def read_snapshot(path, names, version, mmap_mode="r"):
+    """
+    读取目录快照 多个进程mmap同一份文件时共享页缓存
+    :param names: 要读取的数组名
+    :param mmap_mode: 传给np.load None为读入内存
+    :return: (meta, {数组名: 数组}) 快照不存在或版本不符时返回None
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != version:
+        return None
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in names}
+    return meta, arrays
+
+
+def prune_snapshots(snapshot_dir, current, keep=2, tmp_ttl=3600):
+    """
+    删除旧快照 只保留当前快照和最近的 keep-1 个旧快照(回滚或还在用旧表的worker可用)
+    已mmap旧快照的进程不受影响 文件删除后页仍然有效
+    :param current: 当前快照目录
+    :param tmp_ttl: 临时目录超过该秒数才视为写入中途失败的残留并删除
+    """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    now = time.time()
+    snapshots, removed = [], []
+    for name in os.listdir(snapshot_dir):
+        path = os.path.join(snapshot_dir, name)
+        if not name.startswith("jpkb_") or not os.path.isdir(path):
+            continue
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if ".tmp-" in name:
+            if now - mtime > tmp_ttl:
+                removed.append(path)
+        elif os.path.abspath(path) != os.path.abspath(current):
+            snapshots.append((mtime, path))
+    snapshots.sort(reverse=True)
+    removed += [path for _, path in snapshots[max(keep - 1, 0):]]
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
@@ -1,8 +1,18 @@
-
 import time
+import inspect
 from functools import wraps
 from utils.general_utils.loggers import logger
 def timer(func):
+    # 协程函数需要await之后才算完成，单独包一层
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.time()
+            result = await func(*args, **kwargs)
+            logger.info(f"方法：{func.__name__};耗时： {time.time() - start:.3f}s")
+            return result
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = time.time()
@@ -17,4 +27,4 @@ if __name__ == '__main__':
     def test_func():
         time.sleep(1)
         return "Hello, World!"
-    print(test_func())
\ No newline at end of file
+    print(test_func())